@@ -0,0 +1,133 @@
+// client side of the price chart (see the price-store callbacks in the dashboard).
+// the browser keeps the selected ticker's full-resolution history and cuts the slider window / zoom
+// out of it here, so moving the slider or zooming doesn't cost a server round trip.
+// the store's arrays arrive as plotly-style typed arrays ({dtype, bdata}): x is int32 days since 1970,
+// the prices float32
+
+var DAY_MS = 86400000;
+var typed_arrays = {i4: Int32Array, f4: Float32Array, f8: Float64Array};
+var decoded = {store: null, arrays: null}; // last store decoded, the slider/zoom re-renders reuse it
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    prices: {
+        // ask the server for data only when the store can't cover the ticker + years on its own
+        request: function(ticker, years, store) {
+            if (!ticker || !years) {
+                return window.dash_clientside.no_update;
+            }
+            if (store && store.ticker === ticker && store.years && store.years[0] <= years[0] && store.years[1] >= years[1]) {
+                return window.dash_clientside.no_update;
+            }
+            if (store && store.ticker === ticker && store.years) { // widen what we have instead of swapping it out
+                years = [Math.min(store.years[0], years[0]), Math.max(store.years[1], years[1])];
+            }
+            return {ticker: ticker, years: years};
+        },
+
+        render: function(store, years, relayout) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            if (store.placeholder) { // the load failed, the server sent a note instead of prices
+                return store.placeholder;
+            }
+            var triggered = window.dash_clientside.callback_context.triggered.map(function(t) { return t.prop_id; });
+            var x_range = null;
+            if (triggered.indexOf('historical-close-price-chart.relayoutData') !== -1) {
+                if (!relayout) {
+                    return window.dash_clientside.no_update;
+                }
+                if (relayout['xaxis.range[0]'] !== undefined) {
+                    x_range = [relayout['xaxis.range[0]'], relayout['xaxis.range[1]']];
+                } else if (relayout['xaxis.range']) {
+                    x_range = relayout['xaxis.range'];
+                } else if (!relayout['xaxis.autorange']) {
+                    return window.dash_clientside.no_update; // y-only zoom, legend clicks etc.
+                }
+            }
+
+            if (decoded.store !== store) {
+                decoded = {store: store, arrays: {x: decode(store.x), close: decode(store.close),
+                                                  ma50: decode(store.ma50), ma200: decode(store.ma200)}};
+            }
+            var arrays = decoded.arrays;
+            var range = x_range || [years[0] + '-01-01', years[1] + '-12-31'];
+            var first = lowerBound(arrays.x, toDays(range[0]));
+            var last = lowerBound(arrays.x, Math.floor(toDays(range[1])) + 1);
+            var keep = lttb(arrays.close, first, last, store.point_budget);
+            var pick = function(values, scale) { // plain arrays out, the figure is just data to dash
+                return keep.map(function(i) { return values[i] * (scale || 1); });
+            };
+            var type = last - first > store.webgl_threshold ? 'scattergl' : 'scatter';
+            var dates = pick(arrays.x, DAY_MS); // epoch ms, the chart's x axis is a date axis
+
+            var layout = Object.assign({}, store.layout);
+            layout.xaxis = Object.assign({}, layout.xaxis, {range: range, autorange: false});
+            layout.yaxis = Object.assign({}, layout.yaxis, {autorange: true});
+            return {
+                data: [
+                    {type: type, x: dates, y: pick(arrays.close), name: 'Close Price',
+                     marker: {color: '#ffffff', size: 2}, mode: 'markers'},
+                    {type: type, x: dates, y: pick(arrays.ma50), name: '50-day Moving Average'},
+                    {type: type, x: dates, y: pick(arrays.ma200), name: '200-day Moving Average'}
+                ],
+                layout: layout
+            };
+        }
+    }
+});
+
+function decode(spec) { // {dtype, bdata} -> typed array (plain arrays pass through)
+    if (!spec || spec.bdata === undefined) {
+        return spec;
+    }
+    var binary = atob(spec.bdata);
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) { bytes[i] = binary.charCodeAt(i); }
+    return new typed_arrays[spec.dtype](bytes.buffer);
+}
+
+function toDays(date) { // '2005-01-01' or plotly's '2005-01-01 12:30:00.000' -> (fractional) days since 1970, UTC
+    date = String(date);
+    if (date.length > 10) {
+        date = date.replace(' ', 'T') + 'Z';
+    }
+    return Date.parse(date) / DAY_MS;
+}
+
+function lowerBound(sorted, value) { // first index with sorted[i] >= value
+    var lo = 0, hi = sorted.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (sorted[mid] < value) { lo = mid + 1; } else { hi = mid; }
+    }
+    return lo;
+}
+
+function lttb(y, first, last, n_out) {
+    // largest-triangle-three-buckets over y[first:last], same as lttb() on the server.
+    // x is just the row number - trading days are close enough to evenly spaced for picking points
+    var n = last - first, keep = [], i;
+    if (n <= n_out || n_out < 3) {
+        for (i = first; i < last; i++) { keep.push(i); }
+        return keep;
+    }
+    var size = (n - 2) / (n_out - 2), a = first;
+    keep.push(first);
+    for (var b = 0; b < n_out - 2; b++) {
+        var start = first + Math.floor(b * size) + 1, end = first + Math.floor((b + 1) * size) + 1;
+        var next_end = Math.min(first + Math.floor((b + 2) * size) + 1, last);
+        var avg_x = 0, avg_y = 0, count = 0;
+        for (i = end; i < next_end; i++) { avg_x += i; avg_y += y[i] || 0; count++; }
+        if (count) { avg_x /= count; avg_y /= count; } else { avg_x = last - 1; avg_y = y[last - 1] || 0; }
+        var best = start, best_area = -1;
+        for (i = start; i < end; i++) {
+            var area = Math.abs((a - avg_x) * ((y[i] || 0) - (y[a] || 0)) - (a - i) * (avg_y - (y[a] || 0)));
+            if (area > best_area) { best_area = area; best = i; }
+        }
+        keep.push(best);
+        a = best;
+    }
+    keep.push(last - 1);
+    return keep;
+}
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the Stock Overview Dashboard callback pipeline
+
+@author: Jack Vance
+"""
+####
+# Benchmark Suite
+####
+
+# drives getData and the figure builders with fixed synthetic fixtures (providers.SyntheticProvider,
+# seeded per symbol) across ticker counts and history lengths, and reports throughput and p50/p99
+# per stage. no network, so numbers are comparable run to run. save a run with --json and check a
+# later one against it with --baseline to catch regressions before deploying:
+#
+#   python benchmark.py --json before.json
+#   python benchmark.py --baseline before.json --tolerance 0.25   # exits 1 if any p50 got >25% slower
+
+# imports
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import datetime
+import gzip
+
+# fresh cache dir (so cold really is cold) and no background warm-up - before the dashboard imports
+os.environ['STOCK_CACHE_DIR'] = tempfile.mkdtemp(prefix='stock-bench-')
+atexit.register(shutil.rmtree, os.environ['STOCK_CACHE_DIR'], True)
+os.environ['STOCK_WARMUP'] = '0'
+
+import base64
+
+import numpy as np
+import plotly.io as pio
+import plotly.graph_objects as go
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import stock_data
+from indicators import IndicatorEngine, IndicatorCache, DEFAULT_INDICATORS
+from providers import SyntheticProvider, syntheticTickers
+import stock_overview_dashboard_2024_02 as dashboard
+
+
+def timeIt(samples, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+def summarize(samples):
+    samples = np.asarray(samples)
+    return {'n': len(samples),
+            'throughput': len(samples) / samples.sum() if samples.sum() else float('inf'), # ops/s
+            'p50_ms': float(np.percentile(samples, 50) * 1000),
+            'p99_ms': float(np.percentile(samples, 99) * 1000)}
+
+def runConfig(n_tickers, years, repeat, latency):
+    # one (ticker count, history length) combination, every stage timed per ticker
+    stock_data.setProvider(SyntheticProvider(years=years, latency=latency))
+    stock_data.cache.clear()
+    dashboard.figures.invalidate()
+    dashboard.compare_averages.clear()
+    this_year = datetime.date.today().year
+    year_range = [this_year - years + 1, this_year]
+    tickers = syntheticTickers(n_tickers)
+    stages = {name: [] for name in ('getCloses cold', 'getData cold', 'getData warm', 'priceData',
+                                    'financialsTimeline', 'printInfo', 'balanceSheetPlots', 'serialize legacy',
+                                    'serialize json', 'serialize fast', 'compress legacy', 'compress',
+                                    'priceStore cached', 'comparePriceChart', 'indicators full',
+                                    'indicators new close')}
+    # legacy is the panels as they went out before typed arrays (legacyPayloads). the new ones are timed
+    # with the stdlib json engine and with the fast one plotly picks (orjson when installed), which dash uses
+    fast_engine = 'orjson' if pio.json.config.default_engine in ('auto', 'orjson') else 'json'
+    payloads, legacy_payloads = {}, {}
+
+    # every ticker's prices in one batched pass (comparison mode), then start cold again for getData
+    timeIt(stages['getCloses cold'], stock_data.getCloses, tickers, list(year_range))
+    stock_data.cache.clear()
+
+    data = {}
+    for ticker in tickers:
+        data[ticker] = timeIt(stages['getData cold'], stock_data.getData, ticker, list(year_range))
+    for _ in range(repeat):
+        for ticker in tickers:
+            timeIt(stages['getData warm'], stock_data.getData, ticker, list(year_range))
+
+    for _ in range(repeat):
+        for ticker in tickers:
+            prices, info, reduced_financials, balance_sheet = data[ticker]
+            timeIt(stages['priceData'], dashboard.priceData, ticker, info, prices, list(year_range))
+            financials_chart = timeIt(stages['financialsTimeline'], dashboard.financialsTimeline, reduced_financials)
+            timeIt(stages['printInfo'], dashboard.printInfo, info)
+            bs_bar, bs_sunburst = timeIt(stages['balanceSheetPlots'], dashboard.balanceSheetPlots, balance_sheet)
+            # as dicts, the way dash gets them from the figure cache - same for the legacy ones
+            panels = [dashboard.priceStore(ticker, list(year_range))] + \
+                     [figure.to_plotly_json() for figure in (financials_chart, bs_bar, bs_sunburst)]
+            timeIt(stages['serialize json'], lambda: [pio.json.to_json_plotly(panel, engine='json') for panel in panels])
+            encoded = timeIt(stages['serialize fast'],
+                             lambda: [pio.json.to_json_plotly(panel, engine=fast_engine).encode() for panel in panels])
+            timeIt(stages['compress'], lambda: [gzip.compress(data, compresslevel=5) for data in encoded])
+            payloads[ticker] = panels
+
+            legacy = legacyPayloads(info, prices, [financials_chart, bs_bar, bs_sunburst])
+            encoded = timeIt(stages['serialize legacy'],
+                             lambda: [pio.json.to_json_plotly(panel, engine=fast_engine).encode() for panel in legacy])
+            timeIt(stages['compress legacy'], lambda: [gzip.compress(data, compresslevel=5) for data in encoded])
+            legacy_payloads[ticker] = legacy
+
+    for ticker in tickers:
+        dashboard.priceStore(ticker, list(year_range)) # fill the figure cache
+    for _ in range(repeat):
+        for ticker in tickers:
+            timeIt(stages['priceStore cached'], dashboard.priceStore, ticker, list(year_range))
+
+    closes = stock_data.getCloses(tickers, list(year_range))
+    for _ in range(repeat):
+        timeIt(stages['comparePriceChart'], dashboard.comparePriceChart, closes, list(year_range))
+    # every default indicator over all the tickers, from scratch and as a refresh with one new close would
+    # run them - a kept engine extended by the last row
+    indicators = IndicatorCache(DEFAULT_INDICATORS)
+    for _ in range(repeat):
+        timeIt(stages['indicators full'], IndicatorEngine(DEFAULT_INDICATORS).compute, closes)
+        indicators.clear()
+        indicators.compute(closes.iloc[:-1])
+        timeIt(stages['indicators new close'], indicators.compute, closes)
+
+    results = {stage: summarize(samples) for stage, samples in stages.items()}
+    # bytes per ticker for one callback of each panel, old and new
+    for stage, panels in (('serialize legacy', legacy_payloads), ('serialize fast', payloads)):
+        sizes = [payloadBytes(ticker_panels) for ticker_panels in panels.values()]
+        results[stage].update({'%s_bytes' % kind: int(np.mean([size[kind] for size in sizes]))
+                               for kind in ('raw', 'gzip', 'br')})
+    return results
+
+def expandArrays(value): # plotly typed arrays ({dtype, bdata}) back to plain lists, everywhere in a figure
+    if isinstance(value, dict):
+        if set(value) >= {'dtype', 'bdata'}:
+            values = np.frombuffer(base64.b64decode(value['bdata']), dtype=np.dtype(value['dtype']).newbyteorder('<'))
+            return values.reshape(value['shape']).tolist() if 'shape' in value else values.tolist()
+        return {key: expandArrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [expandArrays(item) for item in value]
+    return value
+
+def legacyPayloads(info, prices, figures):
+    # the panels the way they were sent before typed arrays and the trimmed template: the price chart as
+    # every close with its moving averages as date strings and decimal floats, the other figures with
+    # their arrays as lists and the full template (plotly_dark is the untrimmed buffalo_stone)
+    close = prices['Close'].dropna()
+    dates = close.index.strftime('%Y-%m-%d').tolist()
+    price_chart = go.Figure(data=[
+        go.Scatter(x=dates, y=close.tolist(), name='Close Price', marker={'color': '#ffffff', 'size': 2}, mode='markers'),
+        go.Scatter(x=dates, y=close.rolling(50).mean().tolist(), name='50-day Moving Average'),
+        go.Scatter(x=dates, y=close.rolling(200).mean().tolist(), name='200-day Moving Average')])
+    price_chart.update_layout(xaxis_title='Date', yaxis_title='Close Price (USD)', template='plotly_dark',
+                              title='%s Price per Share (%s)' % (info['shortName'], info['symbol']))
+    legacy = [price_chart.to_plotly_json()]
+    for figure in figures:
+        figure = expandArrays(figure.to_plotly_json())
+        figure['layout']['template'] = pio.templates['plotly_dark'].to_plotly_json()
+        legacy.append(figure)
+    return legacy
+
+def payloadBytes(payloads): # what one callback of each payload sends - raw, gzip and brotli (same levels as the server)
+    sizes = {'raw': 0, 'gzip': 0, 'br': 0}
+    for payload in payloads:
+        data = pio.json.to_json_plotly(payload).encode()
+        sizes['raw'] += len(data)
+        sizes['gzip'] += len(gzip.compress(data, compresslevel=5))
+        sizes['br'] += len(brotli.compress(data, quality=5)) if brotli is not None else 0
+    return sizes
+
+def compare(results, baseline, tolerance): # p50 regressions beyond tolerance, as printable lines
+    regressions = []
+    for config, stages in results.items():
+        for stage, stats in stages.items():
+            old = baseline.get(config, {}).get(stage)
+            if old and old['p50_ms'] > 0 and stats['p50_ms'] > old['p50_ms'] * (1 + tolerance):
+                regressions.append('%s %s: p50 %.2fms -> %.2fms' % (config, stage, old['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard data/figure pipeline')
+    parser.add_argument('--tickers', type=int, nargs='+', default=[1, 10, 50], help='ticker counts')
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 30], help='history lengths')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the tickers per stage')
+    parser.add_argument('--latency', type=float, default=0.0, help='synthetic upstream latency per call (s)')
+    parser.add_argument('--json', help='write results here')
+    parser.add_argument('--baseline', help='results from an earlier --json run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 slowdown vs baseline')
+    args = parser.parse_args(argv)
+
+    results = {}
+    print('%-22s %-22s %8s %12s %10s %10s' % ('config', 'stage', 'n', 'ops/s', 'p50 ms', 'p99 ms'))
+    for years in args.years:
+        for n_tickers in args.tickers:
+            config = '%d tickers x %dy' % (n_tickers, years)
+            results[config] = runConfig(n_tickers, years, args.repeat, args.latency)
+            for stage, stats in results[config].items():
+                print('%-22s %-22s %8d %12.1f %10.2f %10.2f' % (config, stage, stats['n'], stats['throughput'],
+                                                                stats['p50_ms'], stats['p99_ms']))
+            for label, stage in (('bytes legacy', 'serialize legacy'), ('bytes typed', 'serialize fast')):
+                sizes = results[config][stage]
+                print('%-22s %-22s %s' % (config, label, ' '.join('%s=%d' % (kind, sizes['%s_bytes' % kind])
+                                                                  for kind in ('raw', 'gzip', 'br')
+                                                                  if kind != 'br' or brotli is not None)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar price store for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Column Store
+####
+
+# price histories as plain .npy arrays on disk, one file per ticker per field plus an int32 date
+# column (days since 1970), opened memory-mapped. frames read from here are zero-copy views of the
+# mapped files, so every worker process shares the same pages through the OS page cache instead of
+# each holding its own float64 copy of every history. STOCK_PRICE_FLOAT32=1 halves it again.
+#
+#   cache/prices/<TICKER>/<version>/Date.npy, Open.npy, High.npy, ..., columns.json
+#   cache/prices/<TICKER>/CURRENT   <- name of the newest version
+#
+# a write never touches a version a reader might have mapped: it builds a new version directory,
+# renames it into place and then points CURRENT at it. all but the last couple of versions are removed
+
+# imports
+import os
+import json
+import time
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from stock_cache import CACHE_DIR
+
+PRICE_STORE_DIR = os.path.join(CACHE_DIR, 'prices')
+PRICE_FLOAT32 = os.environ.get('STOCK_PRICE_FLOAT32', '0') == '1' # ~7 significant digits, plenty for charts
+PRICE_STORE_OPEN = 256 # mapped histories kept open per process
+PRICE_STORE_KEEP = 2 # versions kept per ticker - the current one and the one before, for readers mid-switch
+
+
+class ColumnStore:
+    def __init__(self, path=PRICE_STORE_DIR, float32=PRICE_FLOAT32, max_open=PRICE_STORE_OPEN):
+        self.path = path
+        self.float32 = float32
+        self.max_open = max_open
+        self._open = OrderedDict() # (ticker, version) -> frame of mapped columns
+        self._lock = threading.Lock()
+
+    def _dir(self, ticker):
+        return os.path.join(self.path, ticker.upper().replace('/', '_').replace('\\', '_'))
+
+    def current(self, ticker): # newest version name, None if nothing stored
+        try:
+            with open(os.path.join(self._dir(ticker), 'CURRENT')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def write(self, ticker, prices): # new version of ticker's history, returns the version name
+        version = '%d-%d' % (time.time_ns(), os.getpid())
+        ticker_dir = self._dir(ticker)
+        tmp = os.path.join(ticker_dir, '.tmp-' + version)
+        os.makedirs(tmp)
+        dates = pd.DatetimeIndex(prices.index).values.astype('datetime64[D]').astype(np.int64).astype(np.int32)
+        columns = {}
+        np.save(os.path.join(tmp, 'Date.npy'), dates)
+        for column in prices.columns:
+            values = prices[column].to_numpy()
+            if values.dtype.kind == 'f' and self.float32:
+                values = values.astype(np.float32)
+            elif values.dtype.kind not in 'fiub':
+                values = values.astype(np.float64) # object/extension columns
+            np.save(os.path.join(tmp, '%s.npy' % column), values)
+            columns[column] = values.dtype.str
+        with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+            json.dump({'columns': columns, 'index': prices.index.name, 'rows': len(prices)}, f)
+        os.rename(tmp, os.path.join(ticker_dir, version))
+        with open(os.path.join(ticker_dir, 'CURRENT.tmp-' + version), 'w') as f:
+            f.write(version)
+        os.replace(os.path.join(ticker_dir, 'CURRENT.tmp-' + version), os.path.join(ticker_dir, 'CURRENT'))
+        self._prune(ticker_dir, version)
+        return version
+
+    def _prune(self, ticker_dir, current):
+        versions = sorted((name for name in os.listdir(ticker_dir)
+                           if not name.startswith(('.', 'CURRENT'))),
+                          key=lambda name: int(name.split('-')[0]))
+        for name in versions[:-PRICE_STORE_KEEP]:
+            if name != current:
+                # mapped files stay readable after unlinking on posix. on windows the delete fails
+                # while somebody has them open, the next write tries again
+                shutil.rmtree(os.path.join(ticker_dir, name), ignore_errors=True)
+
+    def read(self, ticker, version=None): # frame of zero-copy (read-only) views, FileNotFoundError if gone
+        version = version or self.current(ticker)
+        if version is None:
+            raise FileNotFoundError('no prices stored for %s' % ticker)
+        key = (ticker.upper(), version)
+        with self._lock:
+            frame = self._open.get(key)
+            if frame is not None:
+                self._open.move_to_end(key)
+                return frame
+        version_dir = os.path.join(self._dir(ticker), version)
+        with open(os.path.join(version_dir, 'columns.json')) as f:
+            layout = json.load(f)
+        dates = np.load(os.path.join(version_dir, 'Date.npy'), mmap_mode='r')
+        index = pd.DatetimeIndex(dates.astype('datetime64[D]').astype('datetime64[ns]'), name=layout['index'])
+        frame = pd.DataFrame({column: np.load(os.path.join(version_dir, '%s.npy' % column), mmap_mode='r')
+                              for column in layout['columns']},
+                             index=index, copy=False) # copy=False keeps one (mapped) block per column
+        with self._lock:
+            self._open[key] = frame
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return frame
+
+    def size(self): # bytes on disk
+        total = 0
+        for root, _, files in os.walk(self.path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._open.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+pytest setup for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+# the modules read their settings at import time, so these have to be in place before any test imports
+# them: a throwaway cache directory, the synthetic provider (no network) and no background warm-up
+import os
+import tempfile
+
+os.environ['STOCK_CACHE_DIR'] = tempfile.mkdtemp(prefix='stock-cache-test-')
+os.environ['STOCK_PROVIDER'] = 'synthetic'
+os.environ['STOCK_PROVIDER_LATENCY'] = '0'
+os.environ['STOCK_WARMUP'] = '0'
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Technical indicators for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Indicator Engine
+####
+
+# computes a configurable set of indicators over a wide close-price frame (dates x tickers) in one
+# vectorized pass - pandas does each rolling/ewm op for every ticker at once, so more tickers just
+# means bigger arrays, not more python calls.
+# keeps a short tail of closes plus the recursive state (EMAs, RSI averages, running peaks) so new
+# closes can be appended with update() without recomputing the whole history.
+# IndicatorCache keeps engines around between calls for wide frames (the comparison chart)
+
+# imports
+import copy
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252 # for annualizing volatility
+INDICATOR_CACHE_ITEMS = 64 # engines an IndicatorCache keeps, per process
+# closes (rows x tickers) before extending a kept engine beats recomputing - below it pandas' fixed cost
+# per op is most of the time either way (measured: 8000 rows x 5 tickers is about break-even)
+INDICATOR_EXTEND_MIN_CELLS = 50000
+
+# (kind, params...) - kinds: sma(n), ema(n), volatility(n), drawdown(), rsi(n), bollinger(n, k)
+DEFAULT_INDICATORS = [('sma', 50),
+                      ('sma', 200),
+                      ('ema', 20),
+                      ('volatility', 20),
+                      ('drawdown',),
+                      ('rsi', 14),
+                      ('bollinger', 20, 2)
+                      ]
+
+
+def indicatorName(spec): # ('sma', 50) -> 'sma50', ('bollinger', 20, 2) -> 'bollinger20'
+    return spec[0] + (str(spec[1]) if len(spec) > 1 else '')
+
+def appendRows(frame, replaced, rows): # frame without its last `replaced` rows, then rows - as one block
+    kept = len(frame) - replaced
+    index = pd.Index(np.concatenate([frame.index.to_numpy()[:kept], rows.index.to_numpy()]), name=frame.index.name)
+    return pd.DataFrame(np.concatenate([frame.to_numpy()[:kept], rows.to_numpy()]), index=index, columns=frame.columns)
+
+def recursive(x, alpha, prev=None): # ewm(adjust=False), optionally continuing from the previous row
+    if prev is None:
+        return x.ewm(alpha=alpha, adjust=False).mean()
+    extended = pd.concat([prev.to_frame().T, x])
+    return extended.ewm(alpha=alpha, adjust=False).mean().iloc[1:]
+
+
+class IndicatorEngine:
+    def __init__(self, indicators=DEFAULT_INDICATORS):
+        self.indicators = [tuple(spec) for spec in indicators]
+        windows = [spec[1] for spec in self.indicators if spec[0] in ('sma', 'volatility', 'bollinger')]
+        self.lookback = max(windows, default=1) + 1 # closes needed before a new row to extend everything
+        self.columns = pd.Index([])
+        self.closes = None # last `lookback` closes
+        self.state = {} # recursive state frames, same tail as closes
+        self.values = {} # name -> full-history frame (dates x tickers). bollinger adds _upper/_lower
+
+    def _run(self, closes, context, prev):
+        # closes = `context` already-processed rows followed by the new rows,
+        # prev = recursive state as of the last context row (None for a from-scratch compute)
+        new = closes.iloc[context:]
+        prev = prev or {}
+        values, state = {}, {}
+        for spec in self.indicators:
+            kind, name = spec[0], indicatorName(spec)
+            last = prev.get(name)
+            if kind == 'sma':
+                values[name] = closes.rolling(spec[1]).mean().iloc[context:]
+            elif kind == 'ema':
+                state[name] = values[name] = recursive(new, 2 / (spec[1] + 1), last)
+            elif kind == 'volatility':
+                returns = closes.pct_change(fill_method=None)
+                values[name] = returns.rolling(spec[1]).std().iloc[context:] * np.sqrt(TRADING_DAYS)
+            elif kind == 'bollinger':
+                mid = closes.rolling(spec[1]).mean()
+                band = closes.rolling(spec[1]).std() * spec[2]
+                values[name + '_upper'] = (mid + band).iloc[context:]
+                values[name + '_lower'] = (mid - band).iloc[context:]
+            elif kind == 'drawdown':
+                peak = new.cummax()
+                if last is not None:
+                    peak = peak.clip(lower=last, axis=1)
+                state[name] = peak
+                values[name] = new / peak - 1
+            elif kind == 'rsi': # wilder's smoothing
+                delta = closes.diff().iloc[context:]
+                gain = recursive(delta.clip(lower=0), 1 / spec[1], prev.get(name + '_gain'))
+                loss = recursive((-delta).clip(lower=0), 1 / spec[1], prev.get(name + '_loss'))
+                state[name + '_gain'], state[name + '_loss'] = gain, loss
+                values[name] = 100 - 100 / (1 + gain / loss)
+            else:
+                raise ValueError('unknown indicator %r' % (spec,))
+        return values, state
+
+    def compute(self, closes): # full history from scratch, returns {name: frame}
+        if not closes.index.is_monotonic_increasing:
+            closes = closes.sort_index()
+        self.columns = closes.columns
+        self.values, state = self._run(closes, 0, None)
+        self.state = {name: frame.iloc[-self.lookback:] for name, frame in state.items()}
+        self.closes = closes.iloc[-self.lookback:]
+        return self.values
+
+    def update(self, new_closes):
+        # append new closes (same tickers). rows at or before the last known date replace it -
+        # e.g. today's intraday close being revised - as long as they're within the kept tail
+        if self.closes is None:
+            return self.compute(new_closes)
+        if not new_closes.index.is_monotonic_increasing:
+            new_closes = new_closes.sort_index()
+        if not new_closes.columns.equals(self.columns):
+            new_closes = new_closes.reindex(columns=self.columns)
+        first = new_closes.index[0]
+        keep = self.closes.index.searchsorted(first) # kept rows before the first new one
+        if len(self.closes) and not keep:
+            raise ValueError('update reaches back past the kept state, compute() the full history instead')
+        context = self.closes.iloc[:keep]
+        prev = {name: frame.iloc[keep - 1] for name, frame in self.state.items()} if keep else None
+        closes = pd.concat([context, new_closes])
+        values, state = self._run(closes, keep, prev)
+        replaced = len(self.closes) - keep
+        for name, frame in values.items():
+            self.values[name] = appendRows(self.values[name], replaced, frame)
+        for name, frame in state.items():
+            self.state[name] = pd.concat([self.state[name].iloc[:keep], frame]).iloc[-self.lookback:]
+        self.closes = closes.iloc[-self.lookback:]
+        return self.values
+
+    def addTickers(self, closes): # new columns, computed on their own and joined on
+        if self.closes is None:
+            return self.compute(closes)
+        other = IndicatorEngine(self.indicators)
+        other.compute(closes)
+        self.columns = self.columns.append(other.columns)
+        self.values = {name: frame.join(other.values[name], how='outer') for name, frame in self.values.items()}
+        self.state = {name: frame.join(other.state[name], how='outer').iloc[-self.lookback:]
+                      for name, frame in self.state.items()}
+        self.closes = self.closes.join(other.closes, how='outer').iloc[-self.lookback:]
+        return self.values
+
+
+class IndicatorCache:
+    # the charts are redrawn whenever a price refresh lands, and that's usually the same history with
+    # a new close (or a revised intraday one) at the end - the cached engine for those tickers is only
+    # extended with update(). a comparison that gained a ticker computes just the new one (addTickers).
+    # anything else - a different start, a history adjusted for a split - is computed from scratch, and
+    # so is anything too small for extending to pay (one ticker's price chart, say). nothing is kept for those
+    def __init__(self, indicators=DEFAULT_INDICATORS, max_items=INDICATOR_CACHE_ITEMS,
+                 min_cells=INDICATOR_EXTEND_MIN_CELLS):
+        self.indicators = indicators
+        self.max_items = max_items
+        self.min_cells = min_cells
+        self._engines = OrderedDict() # frozenset of tickers -> engine over their full aligned closes
+        self._lock = threading.Lock()
+        self.computed = 0 # from scratch vs extended, per process
+        self.extended = 0
+
+    def compute(self, closes): # same {name: frame} as IndicatorEngine(indicators).compute(closes)
+        if closes.size < self.min_cells:
+            return IndicatorEngine(self.indicators).compute(closes)
+        if not closes.index.is_monotonic_increasing:
+            closes = closes.sort_index()
+        key = frozenset(closes.columns)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None: # the biggest cached subset of these tickers, if any
+                subsets = [other for other in self._engines if other < key]
+                engine = self._engines.get(max(subsets, key=len)) if subsets else None
+        # engines are shared between threads: extend a copy, never the cached one
+        engine = None if engine is None else self._extend(copyEngine(engine), closes)
+        if engine is None:
+            engine = IndicatorEngine(self.indicators)
+            engine.compute(closes)
+            self.computed += 1
+        else:
+            self.extended += 1
+        with self._lock:
+            self._engines[key] = engine
+            self._engines.move_to_end(key)
+            while len(self._engines) > self.max_items:
+                self._engines.popitem(last=False)
+        if not engine.columns.equals(closes.columns): # added tickers went on the end
+            return {name: frame[closes.columns] for name, frame in engine.values.items()}
+        return engine.values
+
+    def clear(self):
+        with self._lock:
+            self._engines.clear()
+
+    def _extend(self, engine, closes): # engine brought up to closes, or None if it can't be
+        known = closes if closes.columns.equals(engine.columns) else closes[engine.columns]
+        index = engine.values[indicatorName(engine.indicators[0])].index
+        n = len(index)
+        if len(known) < n or known.index[0] != index[0] or known.index[n - 1] != index[-1]:
+            return None # different start, or rows missing
+        tail = engine.closes.iloc[:-1] # the last close may have been revised since (intraday)
+        if not np.array_equal(known.iloc[n - len(engine.closes):n - 1].to_numpy(), tail.to_numpy(), equal_nan=True):
+            return None # adjusted history
+        if len(known) > n or not np.array_equal(known.iloc[-1].to_numpy(), engine.closes.iloc[-1].to_numpy(),
+                                                equal_nan=True):
+            engine.update(known.iloc[n - 1:])
+        added = closes.columns.difference(engine.columns)
+        if len(added):
+            engine.addTickers(closes[added])
+        return engine
+
+def copyEngine(engine): # shallow - update/addTickers replace frames, they never write into them
+    other = copy.copy(engine)
+    other.values, other.state = dict(engine.values), dict(engine.state)
+    return other
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Instrumentation
+####
+
+# latency histograms per pipeline stage (upstream fetches, figure builders, serialization, whole
+# callback requests), rendered in prometheus text format for the dashboard's /metrics page.
+# everything is per process - scrape each worker
+
+# imports
+import time
+import threading
+from contextlib import ContextDecorator
+
+# seconds. upstream fetches live in the top half, figure work in the bottom half
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q): # estimate from the buckets (upper bound of the bucket q falls in)
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {} # name -> callable returning a number, read at render time
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            return self.histograms[stage]
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def render(self): # prometheus text exposition format
+        lines = ['# TYPE stock_stage_seconds histogram']
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, n in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('stock_stage_seconds_bucket{stage="%s",le="%s"} %d' % (stage, le, cumulative))
+            lines.append('stock_stage_seconds_sum{stage="%s"} %f' % (stage, histogram.sum))
+            lines.append('stock_stage_seconds_count{stage="%s"} %d' % (stage, histogram.count))
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception: # a broken gauge shouldn't take the whole page down
+                continue
+            if value is not None:
+                lines.append('# TYPE %s gauge' % name)
+                lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self): # {stage: {count, p50, p99}} for a quick look without a prometheus server
+        def seconds(bound): # None past the last bucket, json has no infinity
+            return None if bound == float('inf') else bound
+        return {stage: {'count': histogram.count,
+                        'p50': seconds(histogram.quantile(0.5)),
+                        'p99': seconds(histogram.quantile(0.99))}
+                for stage, histogram in sorted(self.histograms.items())}
+
+registry = Registry()
+
+
+class timed(ContextDecorator): # with timed('stage'): ... or @timed('stage')
+    def __init__(self, stage, registry=registry):
+        self.stage = stage
+        self.registry = registry
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self._start)
+        return False
+
+    def _recreate_cm(self): # fresh timer per decorated call, they can run on several threads at once
+        return timed(self.stage, self.registry)
+
+
+def hitRatio(hits, misses): # cache hit ratio, None before anything has been looked up
+    total = hits + misses
+    return None if not total else hits / total
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Background data loads for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Load Jobs
+####
+
+# a cold ticker takes seconds to come back from yahoo - too long to hold a dash worker for. callbacks
+# submit the datasets that aren't cached yet as a job here and return straight away, the page polls
+# the job and draws each panel as soon as its dataset lands. no broker: jobs are a bounded thread pool
+# and a dict, per process (a poll that lands on another worker falls back to checking the cache).
+# a job superseded by a newer selection is cancelled - datasets it hasn't started are dropped, ones
+# already in flight finish into the cache, where the next job picks them up.
+# a job's loads are user loads as far as the warm-up is concerned: started/finished bracket each one
+# (the dashboard passes the warm-up's userRequestStarted/Finished), so background fetches keep yielding
+# to them even though the callback that submitted the job has long returned
+
+# imports
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import stock_data
+
+JOB_WORKERS = 8 # datasets loading at once across all jobs
+JOB_TIMEOUT = 60 # seconds before a dataset still loading is reported as timed out
+JOB_KEEP = 5 * 60 # forget finished jobs after this long
+
+
+class Job:
+    def __init__(self, ticker, year_range, datasets):
+        self.id = uuid.uuid4().hex
+        self.ticker = ticker
+        self.year_range = year_range
+        self.state = {dataset: 'pending' for dataset in datasets} # pending/loading/ready/error/cancelled
+        self.errors = {}
+        self.started = time.time()
+        self.cancelled = threading.Event()
+        self.futures = {}
+
+
+class JobQueue:
+    def __init__(self, load=stock_data.loadDataset, workers=JOB_WORKERS, timeout=JOB_TIMEOUT, keep=JOB_KEEP,
+                 started=None, finished=None):
+        self.load = load # load(ticker, dataset, year_range)
+        self.started = started # started(), finished() around every load, e.g. the warm-up's busy counter
+        self.finished = finished
+        self.timeout = timeout
+        self.keep = keep
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stock-job')
+
+    def submit(self, ticker, year_range, datasets): # job id
+        job = Job(ticker, year_range, datasets)
+        with self._lock:
+            self._prune()
+            self.jobs[job.id] = job
+        job.futures = {dataset: self._pool.submit(self._run, job, dataset) for dataset in datasets}
+        return job.id
+
+    def _run(self, job, dataset):
+        if job.cancelled.is_set():
+            job.state[dataset] = 'cancelled'
+            return
+        job.state[dataset] = 'loading'
+        if self.started is not None:
+            self.started()
+        try:
+            self.load(job.ticker, dataset, job.year_range)
+            job.state[dataset] = 'ready'
+        except Exception as e: # unknown ticker, yahoo hiccup... the panel says so
+            job.errors[dataset] = repr(e)
+            job.state[dataset] = 'error'
+        finally:
+            if self.finished is not None:
+                self.finished()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.cancelled.set()
+        for dataset, future in job.futures.items():
+            if future.cancel(): # never started
+                job.state[dataset] = 'cancelled'
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if now - job.started > self.keep and (job.cancelled.is_set() or self._done(job, now)):
+                del self.jobs[job_id]
+
+    def _done(self, job, now):
+        return now - job.started > self.timeout or all(state in ('ready', 'error', 'cancelled')
+                                                       for state in job.state.values())
+
+    def status(self, job_id): # None if this process doesn't know the job
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        now = time.time()
+        state = dict(job.state)
+        failed = dict(job.errors)
+        if now - job.started > self.timeout:
+            for dataset, s in state.items():
+                if s in ('pending', 'loading'):
+                    failed[dataset] = 'timed out after %ds' % self.timeout
+        return {'ticker': job.ticker,
+                'ready': [dataset for dataset, s in state.items() if s == 'ready'],
+                'failed': failed,
+                'done': job.cancelled.is_set() or self._done(job, now)}
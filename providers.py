@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Upstream data providers for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Data Providers
+####
+
+# stock_data asks a provider for the four raw datasets and caches them. swapping the provider lets us
+# run/benchmark/regression-test the whole dashboard without touching yahoo:
+#   YFinanceProvider      - the real thing
+#   RecordReplayProvider  - records another provider's responses to local files once, then serves
+#                           them offline with configurable (synthetic) latency
+#   SyntheticProvider     - made-up but realistic-looking data for any symbol and any history length
+#
+# pick one with STOCK_PROVIDER: yfinance (default), record:<dir>, replay:<dir>, synthetic[:<years>]
+# and add fake latency per call with STOCK_PROVIDER_LATENCY (seconds)
+
+# imports
+import os
+import time
+import zlib
+import random
+import pickle
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+
+def flattenPrices(prices): # newer yfinance returns (Price, Ticker) columns even for one ticker
+    if isinstance(prices.columns, pd.MultiIndex):
+        prices = prices.droplevel(1, axis=1)
+    return prices
+
+def emptyPrices(): # what a ticker with no trades in the range looks like
+    return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'], index=pd.DatetimeIndex([], name='Date'))
+
+
+class DataProvider: # what stock_data needs from upstream
+    latency = 0.0
+    jitter = 0.0
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed) # deterministic jitter for repeatable benchmark runs
+
+    def delay(self): # synthetic network latency
+        wait = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def prices(self, ticker, start, end): # daily OHLCV, dates in [start, end)
+        raise NotImplementedError
+
+    def pricesMany(self, tickers, start, end): # {ticker: prices} - override where one request can do several
+        return {ticker: self.prices(ticker, start, end) for ticker in tickers}
+
+    def info(self, ticker): # dict like yf.Ticker.info
+        raise NotImplementedError
+
+    def financials(self, ticker): # like yf.Ticker.financials - line items x report dates
+        raise NotImplementedError
+
+    def balance_sheet(self, ticker): # like yf.Ticker.balance_sheet
+        raise NotImplementedError
+
+
+class YFinanceProvider(DataProvider):
+    def prices(self, ticker, start, end):
+        return flattenPrices(yf.download(ticker, start, end, progress=False))
+
+    def pricesMany(self, tickers, start, end): # one download for the lot, columns come back (Ticker, Price)
+        if len(tickers) == 1:
+            return {tickers[0]: self.prices(tickers[0], start, end)}
+        prices = yf.download(list(tickers), start, end, progress=False, group_by='ticker')
+        downloaded = set(prices.columns.get_level_values(0))
+        return {ticker: prices[ticker].dropna(how='all') if ticker in downloaded else emptyPrices()
+                for ticker in tickers}
+
+    def info(self, ticker):
+        return yf.Ticker(ticker).info
+
+    def financials(self, ticker):
+        return yf.Ticker(ticker).financials
+
+    def balance_sheet(self, ticker):
+        return yf.Ticker(ticker).balance_sheet
+
+
+class RecordReplayProvider(DataProvider):
+    # path/<TICKER>/<dataset>.pkl. with an upstream provider every response is recorded (prices are
+    # merged into one history per ticker); without one it replays offline. tickers with no recording
+    # go to `fallback` (e.g. a SyntheticProvider) if given, otherwise raise LookupError
+    def __init__(self, path, upstream=None, fallback=None, latency=0.0, jitter=0.0, seed=0):
+        super().__init__(latency, jitter, seed)
+        self.path = path
+        self.upstream = upstream
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, ticker, dataset):
+        return os.path.join(self.path, ticker.upper(), dataset + '.pkl')
+
+    def _load(self, ticker, dataset):
+        try:
+            with open(self._file(ticker, dataset), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, ticker, dataset, value):
+        path = self._file(ticker, dataset)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def _dataset(self, ticker, dataset):
+        if self.upstream is not None:
+            value = getattr(self.upstream, dataset)(ticker)
+            with self._lock:
+                self._save(ticker, dataset, value)
+            return value
+        self.delay()
+        value = self._load(ticker, dataset)
+        if value is None:
+            if self.fallback is None:
+                raise LookupError('no recording of %s for %s in %s' % (dataset, ticker, self.path))
+            return getattr(self.fallback, dataset)(ticker)
+        return value
+
+    def _record(self, ticker, prices): # merged into everything recorded for ticker so far
+        recorded = self._load(ticker, 'prices')
+        if recorded is not None and len(recorded):
+            merged = pd.concat([recorded, prices])
+            prices = merged[~merged.index.duplicated(keep='last')].sort_index()
+        self._save(ticker, 'prices', prices)
+
+    def _replayPrices(self, ticker, start, end):
+        prices = self._load(ticker, 'prices')
+        if prices is None:
+            if self.fallback is None:
+                raise LookupError('no recording of prices for %s in %s' % (ticker, self.path))
+            return self.fallback.prices(ticker, start, end)
+        return prices.loc[pd.Timestamp(start):pd.Timestamp(end) - pd.Timedelta(days=1)]
+
+    def prices(self, ticker, start, end):
+        if self.upstream is None:
+            self.delay()
+            return self._replayPrices(ticker, start, end)
+        prices = self.upstream.prices(ticker, start, end)
+        with self._lock:
+            self._record(ticker, prices)
+        return prices
+
+    def pricesMany(self, tickers, start, end):
+        if self.upstream is None:
+            self.delay() # one replayed round trip for the batch, like the real thing
+            return {ticker: self._replayPrices(ticker, start, end) for ticker in tickers}
+        batch = self.upstream.pricesMany(tickers, start, end)
+        with self._lock:
+            for ticker, prices in batch.items():
+                self._record(ticker, prices)
+        return batch
+
+    def info(self, ticker):
+        return self._dataset(ticker, 'info')
+
+    def financials(self, ticker):
+        return self._dataset(ticker, 'financials')
+
+    def balance_sheet(self, ticker):
+        return self._dataset(ticker, 'balance_sheet')
+
+
+def syntheticTickers(n): # ['SYN0001', 'SYN0002', ...]
+    return ['SYN%04d' % (i + 1) for i in range(n)]
+
+
+class SyntheticProvider(DataProvider):
+    # deterministic per symbol (seeded from the name), so every process/run sees the same data.
+    # `years` of daily history ending at `end` (today by default)
+    def __init__(self, years=30, end=None, latency=0.0, jitter=0.0, seed=0):
+        super().__init__(latency, jitter, seed)
+        self.years = years
+        self.end = end or datetime.date.today()
+
+    def _rng(self, ticker, salt=''):
+        return np.random.default_rng(zlib.crc32((ticker.upper() + salt).encode()))
+
+    def _history(self, ticker):
+        dates = pd.bdate_range(end=self.end, periods=int(self.years * 252), name='Date')
+        rng = self._rng(ticker)
+        drift, vol = rng.uniform(-0.0001, 0.0004), rng.uniform(0.008, 0.025)
+        close = rng.uniform(10, 300) * np.exp(np.cumsum(rng.normal(drift, vol, len(dates))))
+        spread = np.abs(rng.normal(0, vol / 2, len(dates))) * close
+        return pd.DataFrame({'Open': close + rng.normal(0, 0.25, len(dates)) * spread,
+                             'High': close + spread,
+                             'Low': close - spread,
+                             'Close': close,
+                             'Volume': rng.integers(100000, 50000000, len(dates))},
+                            index=dates)
+
+    def prices(self, ticker, start, end):
+        self.delay()
+        return self._history(ticker).loc[pd.Timestamp(start):pd.Timestamp(end) - pd.Timedelta(days=1)]
+
+    def pricesMany(self, tickers, start, end): # one (synthetic) round trip for the whole batch
+        self.delay()
+        return {ticker: self._history(ticker).loc[pd.Timestamp(start):pd.Timestamp(end) - pd.Timedelta(days=1)]
+                for ticker in tickers}
+
+    def _reports(self, ticker): # (financials, balance sheet) over the last 4 fiscal years
+        rng = self._rng(ticker, 'reports')
+        dates = pd.to_datetime(['%d-12-31' % (self.end.year - 1 - i) for i in range(4)])
+        revenue = rng.uniform(1e9, 4e11) * np.cumprod(np.r_[1, rng.uniform(0.85, 1.05, 3)])
+        cost = revenue * rng.uniform(0.4, 0.7)
+        rnd = revenue * rng.uniform(0, 0.15)
+        opex = cost + rnd + revenue * rng.uniform(0.05, 0.15)
+        operating = revenue - opex
+        financials = pd.DataFrame([revenue, opex, cost, operating, operating * 0.8, rnd],
+                                  index=['Total Revenue', 'Operating Expense', 'Cost Of Revenue',
+                                         'Operating Income', 'Net Income', 'Research And Development'],
+                                  columns=dates)
+
+        def split(total, n): # total into n random positive parts
+            weights = rng.uniform(0.1, 1, (n, len(total)))
+            return weights / weights.sum(axis=0) * total
+
+        assets = revenue * rng.uniform(0.8, 2.5)
+        current, non_current = split(assets, 2)
+        liabilities = assets * rng.uniform(0.3, 0.9)
+        current_liab, non_current_liab = split(liabilities, 2)
+        rows = {'Total Assets': assets, 'Current Assets': current, 'Total Non Current Assets': non_current,
+                'Total Liabilities Net Minority Interest': liabilities,
+                'Current Liabilities': current_liab,
+                'Total Non Current Liabilities Net Minority Interest': non_current_liab}
+        for parent, children in (('Current Assets', ['Inventory', 'Receivables', 'Cash And Cash Equivalents',
+                                                     'Other Short Term Investments', 'Other Current Assets']),
+                                 ('Total Non Current Assets', ['Net PPE', 'Investments And Advances',
+                                                               'Goodwill And Other Intangible Assets',
+                                                               'Other Non Current Assets']),
+                                 ('Current Liabilities', ['Payables And Accrued Expenses',
+                                                          'Current Deferred Liabilities',
+                                                          'Current Debt And Capital Lease Obligation',
+                                                          'Other Current Liabilities']),
+                                 ('Total Non Current Liabilities Net Minority Interest',
+                                  ['Long Term Debt And Capital Lease Obligation',
+                                   'Other Non Current Liabilities'])):
+            rows.update(zip(children, split(rows[parent], len(children))))
+        balance_sheet = pd.DataFrame(rows, index=dates).transpose()
+        return financials, balance_sheet
+
+    def info(self, ticker):
+        self.delay()
+        rng = self._rng(ticker, 'info')
+        financials, balance_sheet = self._reports(ticker)
+        price = float(self._history(ticker)['Close'].iloc[-1])
+        net_income = float(financials.loc['Net Income'].iloc[0])
+        ebitda = float(financials.loc['Operating Income'].iloc[0]) * rng.uniform(1.05, 1.3)
+        debt = float(balance_sheet.loc['Long Term Debt And Capital Lease Obligation'].iloc[0])
+        trailing_pe = rng.uniform(8, 40)
+        market_cap = max(net_income, float(financials.loc['Total Revenue'].iloc[0]) * 0.05) * trailing_pe
+        return {'symbol': ticker.upper(),
+                'shortName': 'Synthetic %s' % ticker.upper(),
+                'longName': 'Synthetic %s Holdings Inc.' % ticker.upper(),
+                'longBusinessSummary': 'Synthetic company generated for offline testing and benchmarks.',
+                'website': 'https://example.com/%s' % ticker.lower(),
+                'sector': str(rng.choice(['Technology', 'Healthcare', 'Financial Services', 'Energy'])),
+                'industry': 'Synthetic',
+                'currentPrice': round(price, 2),
+                'marketCap': market_cap,
+                'trailingPE': trailing_pe if net_income > 0 else None,
+                'forwardPE': trailing_pe / rng.uniform(1.0, 1.3) if net_income > 0 else None,
+                'ebitda': ebitda,
+                'totalDebt': debt,
+                'earningsTimestamp': time.mktime((self.end + datetime.timedelta(days=45)).timetuple())}
+
+    def financials(self, ticker):
+        self.delay()
+        return self._reports(ticker)[0]
+
+    def balance_sheet(self, ticker):
+        self.delay()
+        return self._reports(ticker)[1]
+
+
+def providerFromEnv():
+    spec = os.environ.get('STOCK_PROVIDER', 'yfinance')
+    latency = float(os.environ.get('STOCK_PROVIDER_LATENCY', 0))
+    kind, _, arg = spec.partition(':')
+    if kind == 'yfinance':
+        return YFinanceProvider()
+    if kind == 'record':
+        return RecordReplayProvider(arg or 'recordings', upstream=YFinanceProvider())
+    if kind == 'replay':
+        return RecordReplayProvider(arg or 'recordings', latency=latency)
+    if kind == 'synthetic':
+        return SyntheticProvider(years=float(arg or 30), latency=latency)
+    raise ValueError('unknown STOCK_PROVIDER %r' % spec)
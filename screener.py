@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch screener for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Batch Screener
+####
+
+# the printInfo valuation metrics (plus ratios from the annual reports) for a whole list of tickers,
+# no browser needed. tickers are fetched in parallel through a bounded pool and every row is written
+# out as soon as it finishes, so an interrupted run picks up where it left off.
+#
+#   python screener.py AAPL MSFT GOOG --out screen.csv
+#   python screener.py --file sp500.txt --out screen.parquet --workers 16
+#
+# .csv output is one file appended row by row. .parquet output is a directory of part files
+# (pd.read_parquet reads the whole directory), since a parquet file can't be appended to
+
+# imports
+import os
+import csv
+import sys
+import glob
+import argparse
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from stock_data import getInfo, getFinancials, getBalanceSheet, valuationMetrics, metric_fields
+
+SCREENER_WORKERS = 8
+PARQUET_BATCH = 100 # rows per parquet part file
+
+fields = metric_fields + ['error']
+text_fields = ['symbol', 'name', 'sector', 'industry', 'error']
+
+
+def screenTicker(ticker): # one row, never raises - a bad ticker is just a row with an error
+    row = {'symbol': ticker}
+    try:
+        info = getInfo(ticker)
+    except Exception as e:
+        row['error'] = 'info: %r' % e
+        return row
+    reduced_financials = balance_sheet = None
+    errors = []
+    try:
+        reduced_financials = getFinancials(ticker)
+    except Exception as e: # still worth a row with the info metrics
+        errors.append('financials: %r' % e)
+    try:
+        balance_sheet = getBalanceSheet(ticker)
+    except Exception as e:
+        errors.append('balance_sheet: %r' % e)
+    row.update(valuationMetrics(info, reduced_financials, balance_sheet))
+    row['symbol'] = ticker # yahoo's symbol can differ in case/format from what we asked for
+    row['error'] = '; '.join(errors) or None
+    return row
+
+
+def succeeded(rows): # symbols with at least one row and no error - failed ones get retried on resume
+    ok = rows['error'].isna() | (rows['error'].astype(str).str.strip() == '')
+    return set(rows.loc[ok, 'symbol'].astype(str))
+
+
+class CsvOutput:
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=fields)
+        if not exists:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def done(self): # symbols an earlier run already wrote without an error
+        return succeeded(pd.read_csv(self.path, usecols=['symbol', 'error'], dtype=str))
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    def __init__(self, path, batch=PARQUET_BATCH):
+        self.path = path
+        self.batch = batch
+        self.rows = []
+        if not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+            # fail now, not after an hour of fetching
+            raise SystemExit('parquet output needs pyarrow or fastparquet installed - or use a .csv output')
+        os.makedirs(path, exist_ok=True)
+
+    def parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def done(self):
+        return succeeded(pd.concat([pd.read_parquet(part, columns=['symbol', 'error']) for part in self.parts()]
+                                   or [pd.DataFrame({'symbol': [], 'error': []})]))
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        frame = pd.DataFrame(self.rows, columns=fields)
+        # same column types in every part, even when a whole batch is missing a metric
+        numeric = [field for field in fields if field not in text_fields]
+        frame[numeric] = frame[numeric].astype(float)
+        frame[text_fields] = frame[text_fields].astype(object)
+        part = os.path.join(self.path, 'part-%05d.parquet' % len(self.parts()))
+        frame.to_parquet(part + '.tmp', index=False)
+        os.replace(part + '.tmp', part) # a crash mid-write never leaves half a part behind
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def screen(tickers, out, workers=SCREENER_WORKERS, resume=True, progress=True):
+    output = ParquetOutput(out) if out.endswith('.parquet') else CsvOutput(out)
+    try:
+        if resume:
+            done = output.done()
+            tickers = [ticker for ticker in tickers if ticker not in done]
+        tickers = list(dict.fromkeys(tickers)) # dedupe, keep order
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='screener')
+        try:
+            futures = [pool.submit(screenTicker, ticker) for ticker in tickers]
+            for n, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                output.write(row)
+                if progress:
+                    print('[%d/%d] %s%s' % (n, len(tickers), row['symbol'],
+                                            ' (%s)' % row['error'] if row.get('error') else ''),
+                          file=sys.stderr)
+        finally: # ctrl-c: drop whatever hasn't started, keep everything already written
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        output.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch valuation screener (printInfo metrics for many tickers)')
+    parser.add_argument('tickers', nargs='*', help='ticker symbols')
+    parser.add_argument('--file', help='file with ticker symbols, one per line (or comma separated)')
+    parser.add_argument('--out', required=True, help='output path, .csv or .parquet')
+    parser.add_argument('--workers', type=int, default=SCREENER_WORKERS, help='parallel fetches')
+    parser.add_argument('--no-resume', action='store_true', help='redo tickers already in the output')
+    parser.add_argument('--quiet', action='store_true', help='no per-ticker progress on stderr')
+    args = parser.parse_args(argv)
+
+    tickers = list(args.tickers)
+    if args.file:
+        with open(args.file) as f:
+            tickers += [t.strip() for line in f for t in line.split(',') if t.strip()]
+    tickers = [ticker.upper() for ticker in tickers]
+    if not tickers:
+        parser.error('no tickers given')
+    screen(tickers, args.out, args.workers, resume=not args.no_resume, progress=not args.quiet)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent tiered cache for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Stock Cache
+####
+
+# two tiers: a small in-memory dict per process for millisecond hits, backed by a
+# sqlite file on disk so cached data survives restarts/redeploys and is shared by every worker
+
+# imports
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from plotly.io.json import to_json_plotly
+
+from instrumentation import timed
+try:
+    from orjson import loads # optional, several times faster than json.loads on big figures
+except ImportError:
+    from json import loads
+try:
+    import fcntl # cross-process single-flight locks
+except ImportError: # windows - requests are still coalesced between threads, just not between workers
+    fcntl = None
+
+CACHE_DIR = os.environ.get('STOCK_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CACHE_MAX_BYTES = int(os.environ.get('STOCK_CACHE_MAX_BYTES', 512 * 1024 * 1024)) # disk tier, ~512MB
+MEMORY_MAX_ITEMS = int(os.environ.get('STOCK_CACHE_MEMORY_ITEMS', 256)) # memory tier, per process
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('STOCK_FIGURE_CACHE_MAX_BYTES', 64 * 1024 * 1024)) # per process
+
+MISSING = object() # sentinel, None is a perfectly good thing to cache
+
+
+class TieredCache: # memory tier in front of a sqlite tier
+    def __init__(self, path=None, max_bytes=CACHE_MAX_BYTES, memory_items=MEMORY_MAX_ITEMS):
+        if path is None:
+            path = os.path.join(CACHE_DIR, 'stock_cache.sqlite')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock_dir = os.path.join(os.path.dirname(path), 'locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict() # key -> (expires, stored, value)
+        self._memory_lock = threading.Lock()
+        self._local = threading.local() # sqlite connections can't be shared between threads
+        self._key_locks = {} # key -> lock, so concurrent callers of fetch() share one upstream call
+        self._key_locks_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        db = self._db()
+        db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                          key TEXT PRIMARY KEY,
+                          payload BLOB NOT NULL,
+                          size INTEGER NOT NULL,
+                          stored REAL NOT NULL,
+                          expires REAL NOT NULL,
+                          accessed REAL NOT NULL)''')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        # single-flight counters, shared by every worker using this file
+        db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        db.commit()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL') # readers don't block the writer (multiple workers)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _remember(self, key, expires, stored, value):
+        with self._memory_lock:
+            self._memory[key] = (expires, stored, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _entry(self, key, touch=False, reload=False): # (expires, stored, value) or None, expired entries included
+        if not reload:
+            with self._memory_lock:
+                entry = self._memory.get(key)
+                if entry is not None and entry[0] > time.time():
+                    self._memory.move_to_end(key)
+                    return entry
+        # memory miss - go to disk. bump the access time here rather than on every hit,
+        # memory hits are what keep an entry hot and they shouldn't cost a sqlite write
+        db = self._db()
+        if touch:
+            db.execute('UPDATE entries SET accessed=? WHERE key=?', (time.time(), key))
+            db.commit()
+        row = db.execute('SELECT expires, stored, payload FROM entries WHERE key=?',
+                         (key,)).fetchone()
+        if row is None:
+            return None
+        expires, stored, payload = row
+        try:
+            value = pickle.loads(payload)
+        except Exception: # written by an incompatible pandas/python, treat as a miss
+            self.delete(key)
+            return None
+        self._remember(key, expires, stored, value)
+        return expires, stored, value
+
+    def _fresh(self, key, reload=False):
+        entry = self._entry(key, touch=True, reload=reload)
+        if entry is None or entry[0] <= time.time():
+            return MISSING
+        return entry[2]
+
+    def get(self, key, default=MISSING, reload=False):
+        # reload=True skips the memory tier, for when another worker may have just written the key
+        value = self._fresh(key, reload)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires):
+        # note: cached values are shared between callers, don't mutate what comes back
+        now = time.time()
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                   (key, payload, len(payload), now, expires, now))
+        db.commit()
+        self._remember(key, expires, now, value)
+        self.evict()
+
+    def delete(self, key):
+        with self._memory_lock:
+            self._memory.pop(key, None)
+        db = self._db()
+        db.execute('DELETE FROM entries WHERE key=?', (key,))
+        db.commit()
+
+    def peek(self, key): # the stored value even if expired, without counting a hit/miss (status checks)
+        entry = self._entry(key)
+        return None if entry is None else entry[2]
+
+    def expiresAt(self, key): # None if not cached at all
+        entry = self._entry(key)
+        return None if entry is None else entry[0]
+
+    def storedAt(self, key): # doubles as the version of the data under key, None if not cached
+        entry = self._entry(key)
+        return None if entry is None else entry[1]
+
+    def keyLock(self, key):
+        with self._key_locks_lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    @contextmanager
+    def singleFlight(self, key):
+        # one holder per key across threads (a lock) and across worker processes (flock on a file
+        # next to the db). yields which of the two we had to wait on, so callers can re-check the
+        # cache and count the upstream call they saved
+        waited = {'thread': False, 'process': False}
+        lock = self.keyLock(key)
+        if not lock.acquire(blocking=False):
+            waited['thread'] = True
+            lock.acquire()
+        try:
+            if fcntl is None:
+                yield waited
+                return
+            path = os.path.join(self.lock_dir, hashlib.sha1(key.encode()).hexdigest() + '.lock')
+            with open(path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    waited['process'] = True
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield waited
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock.release()
+
+    def count(self, name, n=1):
+        db = self._db()
+        db.execute('INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value=value+?',
+                   (name, n, n))
+        db.commit()
+
+    def coalesced(self, waited): # count an upstream call somebody else made for us
+        self.count('coalesced_threads' if waited['thread'] else 'coalesced_processes')
+
+    def counters(self): # upstream calls made vs saved by coalescing, across all workers
+        counts = dict(self._db().execute('SELECT name, value FROM counters'))
+        stats = {name: counts.get(name, 0)
+                 for name in ('upstream_calls', 'coalesced_threads', 'coalesced_processes')}
+        stats['saved_calls'] = stats['coalesced_threads'] + stats['coalesced_processes']
+        return stats
+
+    def fetch(self, key, func, expires, refresh=False):
+        # get-or-compute. expires is an absolute epoch time, or a callable returning one
+        # (evaluated after the fetch, e.g. for data that's good until the next earnings date).
+        # when a ticker is popular lots of callers miss at once - only the first one (in any thread
+        # or worker) runs func, the rest wait for it and read the result back out of the cache.
+        # refresh=True recomputes even if the cached value is still fresh (background refresh)
+        if not refresh:
+            value = self.get(key)
+            if value is not MISSING:
+                return value
+        seen = self._entry(key) if refresh else None
+        with self.singleFlight(key) as waited:
+            entry = self._entry(key, reload=True)
+            fresh = entry is not None and entry[0] > time.time()
+            # a refresh only counts as done for us if somebody (maybe another worker's warm-up)
+            # stored a newer value than the one we saw
+            if fresh and (not refresh or seen is None or entry[1] != seen[1]):
+                self.coalesced(waited)
+                return entry[2]
+            self.count('upstream_calls')
+            value = func()
+            self.set(key, value, expires() if callable(expires) else expires)
+        return value
+
+    def evict(self): # size based, least recently accessed rows go first
+        db = self._db()
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9) # leave some headroom so we don't evict every write
+        freed = 0
+        evicted = []
+        for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            evicted.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        db.executemany('DELETE FROM entries WHERE key=?', evicted)
+        db.commit()
+        with self._memory_lock:
+            for (key,) in evicted:
+                self._memory.pop(key, None)
+
+    def clear(self):
+        with self._memory_lock:
+            self._memory.clear()
+        db = self._db()
+        db.execute('DELETE FROM entries')
+        db.commit()
+
+
+class FigureCache: # built figures (or chart data) as serialized JSON, LRU bounded by total bytes, per process
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # key -> (data version, figure json or tuple of them, size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, key, version, build):
+        # build() returns a figure/dict, or a tuple of them. cached JSON is only good for the data version
+        # it was built from - a newer version of the underlying data rebuilds and replaces it
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                serialized = entry[1]
+            else:
+                self.misses += 1
+                serialized = None
+        if serialized is None:
+            built = build()
+            with timed('serialize'):
+                if isinstance(built, tuple):
+                    self.put(key, version, tuple(to_json_plotly(figure) for figure in built))
+                else:
+                    self.put(key, version, to_json_plotly(built))
+            return built
+        if isinstance(serialized, tuple):
+            return tuple(loads(figure) for figure in serialized)
+        return loads(serialized)
+
+    def put(self, key, version, serialized):
+        size = sum(map(len, serialized)) if isinstance(serialized, tuple) else len(serialized)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (version, serialized, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def invalidate(self, match=lambda key: True): # drop everything, or just the keys match() picks
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self.size -= self._entries.pop(key)[2]
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Data retrieval for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Stock Data
+####
+
+# everything that talks to Yahoo lives here, behind the persistent cache in stock_cache.py.
+# the actual upstream calls go through a provider (providers.py) - yfinance unless STOCK_PROVIDER says otherwise
+
+# imports
+import time
+import datetime
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# pandas to handle stock data
+import pandas as pd
+
+from stock_cache import TieredCache
+from colstore import ColumnStore
+from providers import providerFromEnv
+from instrumentation import timed
+
+# how long each dataset stays fresh (seconds)
+PRICE_TTL = 15 * 60 # intraday, the latest close keeps moving while the market is open
+HISTORY_TTL = 7 * 24 * 60 * 60 # full rebuild of a ticker's stitched history now and then (split/dividend adjustments)
+INFO_TTL = 24 * 60 * 60
+REPORT_TTL_DEFAULT = 7 * 24 * 60 * 60 # financials/balance sheet when we don't know the next earnings date
+REPORT_TTL_MAX = 100 * 24 * 60 * 60 # never trust a stale earnings date longer than about a quarter
+
+datasets = ('prices', 'info', 'financials', 'balance_sheet')
+
+FETCH_WORKERS = 8 # bounded, yahoo gets grumpy with too many parallel requests
+DATASET_TIMEOUT = 8 # seconds getData waits on any one dataset before giving up on it
+
+reduced_financials_keys = ['Total Revenue',
+                           'Operating Expense',
+                           'Cost Of Revenue',
+                           'Operating Income',
+                           'Net Income',
+                           'Research And Development'
+                           ]
+
+cache = TieredCache()
+price_store = ColumnStore() # the price arrays themselves - the cache only holds each history's bookkeeping
+provider = providerFromEnv()
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='stock-fetch')
+
+
+def cacheKey(dataset, ticker, *extra):
+    return ':'.join([dataset, ticker.upper()] + [str(e) for e in extra])
+
+def setProvider(new_provider): # e.g. a replay/synthetic provider for benchmarks - use a separate cache dir too
+    global provider
+    provider = new_provider
+
+def yearRangeDates(year_range): # slider years -> (start, end) for the provider, end exclusive
+    today = datetime.date.today()
+    start = datetime.date(int(year_range[0]), 1, 1)
+    end = min(datetime.date(int(year_range[1]) + 1, 1, 1), today + datetime.timedelta(days=1))
+    return start, end
+
+def reportExpiry(ticker): # annual reports are good until the next earnings date
+    now = time.time()
+    info = cache.get(cacheKey('info', ticker), None) or {}
+    upcoming = [ts for ts in (info.get('earningsTimestampStart'),
+                              info.get('earningsTimestamp'),
+                              info.get('earningsTimestampEnd'))
+                if isinstance(ts, (int, float)) and ts > now]
+    if not upcoming:
+        return now + REPORT_TTL_DEFAULT
+    return min(min(upcoming), now + REPORT_TTL_MAX)
+
+def upstream(dataset, ticker, *args): # every provider call, timed per dataset for /metrics
+    with timed('fetch_' + dataset):
+        return getattr(provider, dataset)(ticker, *args)
+
+def fetchPrices(ticker, start, end):
+    return upstream('prices', ticker, start, end)
+
+def fetchPricesMany(tickers, start, end): # one batched upstream call, {ticker: prices}
+    with timed('fetch_prices_many'):
+        return provider.pricesMany(list(tickers), start, end)
+
+def historyGaps(history, start, end, refresh=False): # (start, end) ranges the history is missing
+    # covered range is [start, end) in dates requested (not dates traded), so weekends/holidays
+    # at the edges don't look like gaps
+    if history is None:
+        return [(start, end)]
+    today = datetime.date.today()
+    gaps = []
+    if start < history['start']:
+        gaps.append((start, history['start']))
+    stale = (refresh or time.time() - history['updated'] > PRICE_TTL) and history['end'] > today
+    if end > history['end'] or (end == history['end'] and stale):
+        # days since the last stored close, re-reading that close in case it was intraday
+        tail = history['end']
+        if history['last'] is not None:
+            tail = min(tail, history['last'])
+        gaps.append((tail, end))
+    return gaps
+
+def mergeHistory(history, start, end, frames): # history with freshly fetched frames stitched in
+    created = time.time()
+    if history is not None:
+        frames = [history['prices']] + list(frames)
+        start, end, created = min(start, history['start']), max(end, history['end']), history['created']
+    prices = pd.concat([frame for frame in frames if len(frame)] or frames[:1])
+    prices = prices[~prices.index.duplicated(keep='last')].sort_index()
+    return {'start': start, 'end': end, 'created': created, 'updated': time.time(), 'prices': prices}
+
+def historyMeta(ticker, reload=False): # a history's bookkeeping (no prices), None if not cached
+    meta = cache.get(cacheKey('history', ticker), None, reload=reload)
+    if meta is not None and 'version' not in meta:
+        return None # from before the column store, refetch it
+    return meta
+
+def withPrices(ticker, meta): # meta + its prices from the column store, None if they've gone missing
+    if meta is None:
+        return None
+    try:
+        return dict(meta, prices=price_store.read(ticker, meta['version']))
+    except FileNotFoundError: # store cleared underneath the cache - refetch
+        return None
+
+def saveHistory(ticker, history): # prices to the column store, the rest to the cache
+    prices = history['prices']
+    meta = {name: value for name, value in history.items() if name != 'prices'}
+    meta['version'] = price_store.write(ticker, prices)
+    meta['last'] = prices.index[-1].date() if len(prices) else None
+    cache.set(cacheKey('history', ticker), meta, history['created'] + HISTORY_TTL)
+    return withPrices(ticker, meta)
+
+def priceHistory(ticker, start, end, refresh=False):
+    # per-ticker price store holding the union of every range fetched so far.
+    # only the missing edges ever go upstream
+    key = cacheKey('history', ticker)
+    meta = historyMeta(ticker)
+    if not historyGaps(meta, start, end, refresh):
+        history = withPrices(ticker, meta)
+        if history is not None:
+            return history
+        meta = None
+    seen = meta and meta['updated']
+
+    # one history update per ticker at a time, across threads and workers
+    with cache.singleFlight(key) as waited:
+        # somebody may have filled the gap while we waited
+        history = withPrices(ticker, historyMeta(ticker, reload=True))
+        if history and history['updated'] != seen:
+            refresh = False # ...or refreshed it, no need to do that twice
+        gaps = historyGaps(history, start, end, refresh)
+        if not gaps:
+            cache.coalesced(waited)
+            return history
+        cache.count('upstream_calls', len(gaps))
+        history = mergeHistory(history, start, end, [fetchPrices(ticker, gap_start, gap_end)
+                                                     for gap_start, gap_end in gaps])
+        return saveHistory(ticker, history)
+
+def priceHistories(tickers, start, end): # priceHistory for several tickers at once, {ticker: history}
+    # tickers missing the same ranges (e.g. all cold) share one batched download per range, instead
+    # of one request each. the download happens holding every one of those tickers' history locks
+    # (the same single-flight as priceHistory), so a concurrent compare or single-ticker load waits
+    # for it and reads the result instead of downloading the same thing again
+    histories, stale = {}, []
+    for ticker in dict.fromkeys(tickers):
+        history = withPrices(ticker, historyMeta(ticker))
+        if historyGaps(history, start, end):
+            stale.append(ticker)
+        else:
+            histories[ticker] = history
+    if not stale:
+        return histories
+    with ExitStack() as locks:
+        # always taken in the same (sorted) order, so two batches can't each hold what the other wants
+        waited = {ticker: locks.enter_context(cache.singleFlight(cacheKey('history', ticker)))
+                  for ticker in sorted(stale)}
+        current, groups = {}, {}
+        for ticker in stale: # somebody may have filled the gaps while we waited
+            current[ticker] = withPrices(ticker, historyMeta(ticker, reload=True))
+            gaps = historyGaps(current[ticker], start, end)
+            if gaps:
+                groups.setdefault(tuple(gaps), []).append(ticker)
+            else:
+                cache.coalesced(waited[ticker])
+                histories[ticker] = current[ticker]
+        for gaps, group in groups.items():
+            fetched = {ticker: [] for ticker in group}
+            for gap_start, gap_end in gaps:
+                for ticker, prices in fetchPricesMany(group, gap_start, gap_end).items():
+                    fetched[ticker].append(prices)
+            cache.count('upstream_calls', len(gaps))
+            for ticker in group:
+                histories[ticker] = saveHistory(ticker, mergeHistory(current[ticker], start, end, fetched[ticker]))
+    return histories
+
+def getPrices(ticker, year_range, refresh=False):
+    start, end = yearRangeDates(year_range)
+    prices = priceHistory(ticker, start, end, refresh)['prices']
+    return prices.loc[pd.Timestamp(start):pd.Timestamp(end - datetime.timedelta(days=1))]
+
+def getCloses(tickers, year_range): # close prices for several tickers aligned on date, dates x tickers
+    start, end = yearRangeDates(year_range)
+    histories = priceHistories(tickers, start, end)
+    closes = pd.concat({ticker: histories[ticker]['prices']['Close'] for ticker in tickers}, axis=1).sort_index()
+    return closes.loc[pd.Timestamp(start):pd.Timestamp(end - datetime.timedelta(days=1))]
+
+def getInfo(ticker, refresh=False): #general stock info
+    return cache.fetch(cacheKey('info', ticker),
+                       lambda: upstream('info', ticker),
+                       time.time() + INFO_TTL, refresh)
+
+def getFinancials(ticker, refresh=False): #tick.financials, only the rows we plot
+    financials = cache.fetch(cacheKey('financials', ticker),
+                             lambda: upstream('financials', ticker),
+                             lambda: reportExpiry(ticker), refresh)
+    rf_keys = [key for key in reduced_financials_keys if key in financials.index]
+    return financials.transpose()[rf_keys]
+
+def getBalanceSheet(ticker, refresh=False): #tick.balance_sheet
+    balance_sheet = cache.fetch(cacheKey('balance_sheet', ticker),
+                                lambda: upstream('balance_sheet', ticker),
+                                lambda: reportExpiry(ticker), refresh)
+    return balance_sheet.transpose()
+
+def getFinancialsMany(tickers): # {ticker: reduced financials, None if it has none}. no batch endpoint for reports, so concurrently
+    futures = {ticker: fetch_pool.submit(getFinancials, ticker) for ticker in tickers}
+    financials = {}
+    for ticker, future in futures.items():
+        try:
+            financials[ticker] = future.result()
+        except Exception: # ETFs have no reports, a bad custom ticker nothing at all - neither should sink the rest
+            financials[ticker] = None
+    return financials
+
+#tick.major_holders, tick.cashflow, tick.earnings #not used, could be
+
+
+def datasetExpiry(ticker, dataset): # when a dataset goes stale, None if it isn't cached at all
+    if dataset != 'prices':
+        return cache.expiresAt(cacheKey(dataset, ticker))
+    key = cacheKey('history', ticker)
+    expires = cache.expiresAt(key)
+    history = cache.peek(key)
+    if history is not None and history['end'] > datetime.date.today():
+        expires = min(expires, history['updated'] + PRICE_TTL) # latest close is intraday
+    return expires
+
+def dataVersion(ticker, *names): # version of each dataset (when it was last stored), for figure caching
+    versions = []
+    for dataset in names:
+        if dataset == 'prices':
+            history = cache.peek(cacheKey('history', ticker))
+            versions.append(None if history is None else history['updated'])
+        else:
+            versions.append(cache.storedAt(cacheKey(dataset, ticker)))
+    return tuple(versions)
+
+def loadDataset(ticker, dataset, year_range, refresh=False): # one dataset by name, through the cache
+    if dataset == 'prices':
+        getPrices(ticker, year_range, refresh)
+    elif dataset == 'info':
+        getInfo(ticker, refresh)
+    elif dataset == 'financials':
+        getFinancials(ticker, refresh)
+    elif dataset == 'balance_sheet':
+        getBalanceSheet(ticker, refresh)
+
+def refreshDataset(ticker, dataset, year_range): # refetch one dataset even if it's still fresh
+    loadDataset(ticker, dataset, year_range, refresh=True)
+
+def datasetReady(ticker, dataset, year_range=None): # would the getter answer from the cache, without going upstream?
+    now = time.time()
+    expires = datasetExpiry(ticker, dataset)
+    if dataset != 'prices' or expires is None:
+        return expires is not None and expires > now
+    key = cacheKey('history', ticker)
+    history = cache.peek(key)
+    start, end = yearRangeDates(year_range)
+    if history is None or cache.expiresAt(key) <= now or start < history['start'] or end > history['end']:
+        return False
+    return end < history['end'] or expires > now # only the open end of the history goes stale intraday
+
+
+#valuation metrics - what printInfo shows, plus ratios from the reports for the batch screener.
+#yahoo doesn't return every field for every ticker, anything missing comes back as None
+metric_fields = ['symbol', 'name', 'sector', 'industry', 'price', 'market_cap',
+                 'trailing_pe', 'forward_pe', 'ebitda', 'total_debt', 'debt_to_ebitda',
+                 'revenue', 'operating_income', 'net_income', 'operating_margin', 'net_margin',
+                 'rd_intensity', 'revenue_growth',
+                 'total_assets', 'total_liabilities', 'current_ratio', 'liabilities_to_assets']
+
+def number(value): # float, or None for missing/NaN/non-numeric
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+def ratio(top, bottom):
+    if top is None or not bottom:
+        return None
+    return top / bottom
+
+def latest(frame, column, back=0): # most recent annual value of column (back=1 -> the year before)
+    if frame is None or column not in frame.columns:
+        return None
+    values = frame[column].sort_index(ascending=False).dropna()
+    return number(values.iloc[back]) if len(values) > back else None
+
+def valuationMetrics(info, reduced_financials=None, balance_sheet=None):
+    info = info or {}
+    metrics = {'symbol': info.get('symbol'),
+               'name': info.get('longName') or info.get('shortName'),
+               'sector': info.get('sector'),
+               'industry': info.get('industry'),
+               'price': number(info.get('currentPrice')),
+               'market_cap': number(info.get('marketCap')),
+               'trailing_pe': number(info.get('trailingPE')),
+               'forward_pe': number(info.get('forwardPE')),
+               'ebitda': number(info.get('ebitda')), #earnings before interest, tax, depreciation, amoritization
+               'total_debt': number(info.get('totalDebt'))}
+    metrics['debt_to_ebitda'] = ratio(metrics['total_debt'], metrics['ebitda'])
+
+    revenue = latest(reduced_financials, 'Total Revenue')
+    metrics['revenue'] = revenue
+    metrics['operating_income'] = latest(reduced_financials, 'Operating Income')
+    metrics['net_income'] = latest(reduced_financials, 'Net Income')
+    metrics['operating_margin'] = ratio(metrics['operating_income'], revenue)
+    metrics['net_margin'] = ratio(metrics['net_income'], revenue)
+    metrics['rd_intensity'] = ratio(latest(reduced_financials, 'Research And Development'), revenue)
+    previous = latest(reduced_financials, 'Total Revenue', back=1)
+    metrics['revenue_growth'] = None if revenue is None else ratio(revenue - (previous or 0), previous)
+
+    metrics['total_assets'] = latest(balance_sheet, 'Total Assets')
+    metrics['total_liabilities'] = latest(balance_sheet, 'Total Liabilities Net Minority Interest')
+    metrics['current_ratio'] = ratio(latest(balance_sheet, 'Current Assets'),
+                                     latest(balance_sheet, 'Current Liabilities'))
+    metrics['liabilities_to_assets'] = ratio(metrics['total_liabilities'], metrics['total_assets'])
+    return metrics
+
+
+def getData(ticker, year_range, timeout=DATASET_TIMEOUT): #all data pulling functions
+    # every dataset is fetched once, all at the same time, so a cold load costs about as long as the
+    # slowest request instead of the sum of them. anything still out after the timeout comes back
+    # as None (partial results) - the fetch keeps going in the background and lands in the cache
+    futures = [fetch_pool.submit(getPrices, ticker, year_range),
+               fetch_pool.submit(getInfo, ticker),
+               fetch_pool.submit(getFinancials, ticker),
+               fetch_pool.submit(getBalanceSheet, ticker)]
+    deadline = time.monotonic() + timeout
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except TimeoutError:
+            results.append(None)
+    prices, info, reduced_financials, balance_sheet = results
+    return prices, info, reduced_financials, balance_sheet
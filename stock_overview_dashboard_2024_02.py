@@ -13,20 +13,38 @@ Created on Fri Jul 22 11:11:28 2022
 # input ticker (dropdown) and year(s)/TTM (multiselector - averaging) to view (IMO) most relevant info
 
 # imports
-import datetime
+import os
+import gzip
+import time
+import base64
+import pstats
+import cProfile
 # dash components
 import dash
 from dash import html
 from dash import dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.io as pio
+from flask import request, g, jsonify, Response, abort
+try:
+    import brotli # optional, smaller than gzip for the same CPU
+except ImportError:
+    brotli = None
 
 
-# pandas, yfinance to grab stock data
+# pandas to handle stock data, yfinance calls are behind the cache in stock_data
+import numpy as np
 import pandas as pd
-import yfinance as yf
+from stock_data import (cache, datasets, dataVersion, datasetReady, getPrices, getInfo, getFinancials,
+                        getBalanceSheet, valuationMetrics, getCloses, getFinancialsMany)
+from stock_cache import FigureCache, CACHE_DIR
+from warmup import WarmupScheduler
+from jobs import JobQueue
+from symbols import SymbolIndex, normalize, usLooking
+from indicators import IndicatorEngine, IndicatorCache
+from instrumentation import registry, timed, hitRatio
 
 #plot templates to change style for all, including html
 template_base = 'plotly_dark'
@@ -38,6 +56,16 @@ pio.templates['buffalo_stone'].layout['xaxis']['gridcolor'] = '#696969'
 pio.templates['buffalo_stone'].layout['yaxis']['gridcolor'] = '#696969'
 pio.templates['buffalo_stone'].layout['yaxis']['zerolinecolor'] = '#ffffff'
 
+#the template goes out with every single figure - trim it to the trace types and axes we actually draw
+template_traces = ('scatter', 'scattergl', 'bar')
+template_unused = ('geo', 'polar', 'ternary', 'scene', 'mapbox', 'map', 'coloraxis', 'colorscale',
+                   'sliderdefaults', 'updatemenudefaults', 'annotationdefaults', 'shapedefaults')
+buffalo_stone = pio.templates['buffalo_stone'].to_plotly_json()
+buffalo_stone['data'] = {trace: buffalo_stone['data'][trace] for trace in template_traces}
+for key in template_unused:
+    buffalo_stone['layout'].pop(key, None)
+pio.templates['buffalo_stone'] = go.layout.Template(buffalo_stone)
+
 template = 'buffalo_stone' 
 
 pio.templates.default = template
@@ -53,77 +81,70 @@ bg_color = pio.templates[template].layout['paper_bgcolor']
 #bg_color = "#696969"
 
 #define functions for later use - simplifies calls later, might speed reruns slightly
-def getData(ticker, year_range): #all data pulling functions
-    # price chart from pdr
-    year_range[0] = str(year_range[0])+'-1-1'
-    
-    if year_range[1] == datetime.date.today().year:
-        year_range[1] = datetime.date.today()
-    else:
-        year_range[1] = str(year_range[1])+'-12-31'
-        
-    prices = yf.download(ticker, year_range[0], year_range[1])
-    
-    # everything else from yf
-    tick = yf.Ticker(ticker)
-    
-    #general stock info
-    info = tick.info
-    
-    #tick.financials
-    reduced_financials_keys = ['Total Revenue',
-                              'Operating Expense',
-                              'Cost Of Revenue',
-                              'Operating Income',
-                              'Net Income',
-                              'Research And Development'                       
-                              ]
-    rf_keys = []
-    for key in reduced_financials_keys:
-        if key in tick.financials.index:
-            rf_keys.append(key)
-    reduced_financials = tick.financials.transpose()[rf_keys]
-    
-    #tick.major_holders 
-    
-    #tick.balance_sheet
-    balance_sheet = tick.balance_sheet.transpose()
- 
-    #tick.cashflow #not used, could be
-    
-    #tick.earnings #not used, could be
-    
-    return prices, info, reduced_financials, balance_sheet
-    
+#data pulling (and caching) lives in stock_data.py
 
-def priceChart(info, prices): #price chart function - top dead center
-    ma50 = prices['Close'].rolling(50).mean()
-    ma200 = prices['Close'].rolling(200).mean()
-
-    price_chart = go.Figure(data=[
-        go.Scatter(
-            x=prices.index,
-            y=prices['Close'],
-            name='Close Price',
-            marker={'color':'#ffffff', 'size':2},
-            mode='markers'),
-        go.Scatter(
-            x=prices.index,
-            y=ma50,
-            name='50-day Moving Average'),
-        go.Scatter(
-            x=prices.index,
-            y=ma200,
-            name='200-day Moving Average')
-        ])
-    
-    price_chart.update_layout(
+PRICE_POINT_BUDGET = 2000 # ~2 points per horizontal pixel of a full-width chart, more doesn't show
+WEBGL_THRESHOLD = 2500 # raw points in the window before the price chart switches svg -> webgl
+
+price_chart_indicators = [('sma', 50), ('sma', 200)]
+compare_indicators = [('sma', 50)]
+#kept between redraws, so a price refresh only runs the comparison's averages over the new closes
+compare_averages = IndicatorCache(compare_indicators)
+
+def priceYears(year_range): # years of prices a chart of year_range reads - one early, so the moving averages are warm
+    return [int(year_range[0]) - 1, int(year_range[1])]
+
+def dateAxis(index): # dates as epoch milliseconds - one float64 in a binary array per point, not a date string
+    return index.values.astype('datetime64[ms]').astype(np.float64)
+
+def typedArray(values, dtype): # plotly.js typed array spec {dtype, bdata}: raw little-endian bytes, base64
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': values.dtype.str[1:], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+def lttb(x, y, n_out): # largest-triangle-three-buckets downsampling, returns indices of the points to keep
+    # keeps the visual shape (peaks/troughs) of the series with n_out points, unlike every-nth sampling
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int) # n_out-2 buckets between the fixed end points
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+@timed('priceData')
+def priceData(ticker, info, prices, year_range): # price chart data for the browser to window/zoom itself
+    # full-resolution closes and moving averages for every year in year_range, plus the chart layout.
+    # prices should start a year early so the moving averages are already warmed up at the first date.
+    # arrays go as binary typed arrays (assets/price_window.js decodes them): dates as int32 days since
+    # 1970, prices as float32 - plenty for drawing, and a fraction of the size of JSON text
+    close = prices['Close'].dropna()
+    indicators = IndicatorEngine(price_chart_indicators).compute(close.to_frame())
+    keep = close.index >= pd.Timestamp(int(year_range[0]), 1, 1)
+    layout = go.Figure().update_layout(
         xaxis_title='Date',
+        xaxis_type='date',
         yaxis_title='Close Price (USD)',
         title='%s Price per Share (%s)'%(info['shortName'], info['symbol']))
+    return {'ticker': ticker, # as selected, the browser matches it against the dropdown
+            'years': [int(year_range[0]), int(year_range[1])],
+            'x': typedArray(close.index[keep].values.astype('datetime64[D]').astype(np.int64), 'i4'),
+            'close': typedArray(close[keep], 'f4'),
+            'ma50': typedArray(indicators['sma50'].iloc[:, 0][keep], 'f4'),
+            'ma200': typedArray(indicators['sma200'].iloc[:, 0][keep], 'f4'),
+            'layout': layout.to_plotly_json()['layout'],
+            'point_budget': PRICE_POINT_BUDGET,
+            'webgl_threshold': WEBGL_THRESHOLD}
 
-    return price_chart
-
+@timed('financialsTimeline')
 def financialsTimeline(reduced_financials): #row 2, left side
     fin_plot = px.line(
         reduced_financials, 
@@ -138,42 +159,45 @@ def financialsTimeline(reduced_financials): #row 2, left side
                            legend_title="")
     return fin_plot
 
+def fmt(value, spec): # formatted number, or N/A when yahoo didn't give us one
+    return 'N/A' if value is None else format(value, spec)
+
+@timed('printInfo')
 def printInfo(info): #row two, right side
     # lots of info to pick from, what do you want?
-    name = info['longName']
+    # numbers come from valuationMetrics (shared with the batch screener), which copes with missing fields
+    metrics = valuationMetrics(info)
+    name = metrics['name'] or info.get('symbol', '')
     #snam = info['shortName']
-    summ = info['longBusinessSummary']+" "#[0:1253] (1226/META, 1076/GOOG)
-    web = info['website']
-    ind = info['industry']
-    sect = info['sector']
-    price = info['currentPrice']
-    fpe = info['forwardPE']
-    tpe = info['trailingPE']
+    summ = (info.get('longBusinessSummary') or '')+" "#[0:1253] (1226/META, 1076/GOOG)
+    web = info.get('website', '')
+    ind = metrics['industry'] or 'N/A'
+    sect = metrics['sector'] or 'N/A'
+    price = fmt(metrics['price'], '')
+    fpe = fmt(metrics['forward_pe'], '.2f')
+    tpe = fmt(metrics['trailing_pe'], '.2f')
     #fte = into['fullTimeEmployees']
-    cap = info['marketCap']
+    cap = fmt(metrics['market_cap'], ',.0f')
     #rec = info['recommendationKey']
     #tplow = info['targetLowPrice']
     #tpavg = info['targetMeanPrice']
     #tpmid = info['targetMedianPrice']
     #tphigh = info['targetHighPrice']
     #peg = 
-    ebitda = info['ebitda'] #earnings before interest, tax, depreciation, amoritization
     #dte = info['debtToEquity']
     #spe = #shiller pe (standardized w/ inflation)
-    try:
-        debitda = info['totalDebt'] / ebitda #debt to ebitda
-    except:
-        debitda = "N/A"
+    debitda = fmt(metrics['debt_to_ebitda'], '.3') #debt to ebitda
     
     text = (f'{name}    {web}'+'\n',
             f'Sector: {sect};    Industry: {ind}'+'\n',
-            f'Current Price per Share: ${price};    Market Capitalization: ${cap:,.0f}'+'\n',
-            f'Trailing P/E: {tpe:.2f};    Forward P/E: {fpe:.2f}'+'\n',
-            f'Debt to EBITDA Ratio: {debitda:.3}'+'\n',
+            f'Current Price per Share: ${price};    Market Capitalization: ${cap}'+'\n',
+            f'Trailing P/E: {tpe};    Forward P/E: {fpe}'+'\n',
+            f'Debt to EBITDA Ratio: {debitda}'+'\n',
             f'{summ}'+'\n')
     return text
     
     
+@timed('balanceSheetPlots')
 def balanceSheetPlots(balance_sheet): # could be two separate functions
     #Assets v Liab bar chart - 3rd row, left
     x = ['Total Assets', 'Total Liabilities Net Minority Interest']
@@ -298,6 +322,91 @@ def balanceSheetPlots(balance_sheet): # could be two separate functions
         )
     return bs_bar, bs_sunburst
 
+@timed('comparePriceChart')
+def comparePriceChart(closes, year_range): # several tickers on one chart, each rebased to 100 at the start
+    # closes is the aligned dates x tickers frame, starting a year early so the moving averages are warm.
+    # indicators and rebasing are whole-frame ops - only building the traces goes ticker by ticker
+    averages = compare_averages.compute(closes)['sma50']
+    window = closes.index >= pd.Timestamp(int(year_range[0]), 1, 1)
+    closes, averages = closes[window], averages[window]
+    base = closes.bfill().iloc[0] # first close in the window, per ticker
+    normalized, averages = closes / base * 100, averages / base * 100
+    scatter = go.Scattergl if len(closes) > WEBGL_THRESHOLD else go.Scatter
+    colors = px.colors.qualitative.Plotly
+
+    compare_chart = go.Figure()
+    for i, ticker in enumerate(closes.columns):
+        series = normalized[ticker].dropna()
+        keep = lttb(series.index.asi8 / 1e9, series.to_numpy(dtype=float), PRICE_POINT_BUDGET)
+        dates = series.index[keep]
+        color = colors[i % len(colors)]
+        compare_chart.add_trace(scatter(x=dateAxis(dates), y=series.iloc[keep], name=ticker,
+                                        legendgroup=ticker, line={'color': color}))
+        compare_chart.add_trace(scatter(x=dateAxis(dates), y=averages[ticker].reindex(dates),
+                                        name='%s 50-day MA' % ticker,
+                                        legendgroup=ticker, line={'color': color, 'dash': 'dot'}))
+
+    compare_chart.update_layout(
+        xaxis_title='Date',
+        xaxis_type='date',
+        yaxis_title='Price (start of range = 100)',
+        title='Relative Performance')
+    return compare_chart
+
+@timed('compareFinancials')
+def compareFinancials(financials): # latest annual reduced financials, tickers side by side
+    # tickers without any (None or empty) are left out of the bars and named in the title instead
+    missing = [ticker for ticker, reduced_financials in financials.items()
+               if reduced_financials is None or not len(reduced_financials)]
+    if len(missing) == len(financials):
+        return placeholderFigure('No financials for %s' % ', '.join(missing))
+    latest = pd.DataFrame({ticker: reduced_financials.sort_index().iloc[-1]
+                           for ticker, reduced_financials in financials.items() if ticker not in missing})
+    compare_bars = go.Figure([go.Bar(x=latest.index, y=latest[ticker], name=ticker,
+                                     hovertemplate='%{x} <br> $%{y:,.0f}') for ticker in latest.columns])
+    compare_bars.update_layout(
+        barmode='group',
+        yaxis_title='USD',
+        title='Latest Annual Cashflows' + (' (no financials for %s)' % ', '.join(missing) if missing else ''))
+    return compare_bars
+
+def placeholderFigure(message): # empty panel with a note - still loading, or the load failed
+    placeholder = go.Figure()
+    placeholder.update_layout(
+        xaxis={'visible': False},
+        yaxis={'visible': False},
+        annotations=[{'text': message, 'showarrow': False, 'font': {'size': 16}}])
+    return placeholder
+
+#dropdown tickers - also what the warm-up scheduler keeps fresh in the background
+company_options = [
+    {'label': 'Apple : AAPL', 'value': 'AAPL'},
+    {'label': 'Microsoft : MSFT', 'value': 'MSFT'},
+    {'label': 'Alphabet (CLass A) : GOOGL', 'value': 'GOOGL'},
+    {'label': 'Alphabet (Class C) : GOOG', 'value': 'GOOG'},
+    {'label': 'Amazon : AMZN', 'value': 'AMZN'},
+    {'label': 'Tesla : TSLA', 'value': 'TSLA'},
+    {'label': 'Berkshire Hathaway (Class B) : BRK-B', 'value': 'BRK-B'},
+    {'label': 'NVIDIA : NVDA', 'value': 'NVDA'},
+    {'label': 'Meta (Class A) : META', 'value': 'META'},
+    {'label': 'UnitedHealth : UNH', 'value': 'UNH'},
+    {'label': 'Visa : V', 'value': 'V'},
+    {'label': 'Johnson & Johnson : JNJ', 'value': 'JNJ'},
+    {'label': 'Walmart : WMT', 'value': 'WMT'},
+    {'label': 'JPMorgan Chase & Co. : JPM', 'value': 'JPM'},
+    {'label': 'The Procter & Gamble Company : PG', 'value': 'PG'},
+    {'label': 'Mastercard Incorporated : MA', 'value': 'MA'},
+    {'label': 'Bank of America Corporation : BAC', 'value': 'BAC'},
+    {'label': 'Exxon Mobil Corporation : XOM', 'value': 'XOM'},
+    {'label': 'The Home Depot : HD', 'value': 'HD'},
+    {'label': 'Chevron Corporation : CVX', 'value': 'CVX'}
+    ]
+
+#every listed symbol, for checking/labelling custom tickers and search-as-you-type (symbols.py)
+symbols = SymbolIndex(seed=[(option['value'], option['label'].rsplit(' : ', 1)[0]) for option in company_options])
+
+default_year_range = (2018, 2022)
+
 #create dash app
 app = dash.Dash(__name__, title='Buy-Son Stock Evaluator')
 
@@ -315,7 +424,7 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                 html.Div(children=[html.H1('Buy-Son (Stock Evaluation Dashboard)',
                                                   style={'textAlign': 'center',
                                                          'font-size': 32}),
-                                          html.H2('~10s to retrieve new data',
+                                          html.H2('~10s to retrieve new data (cached after the first load)',
                                                   style={'textAlign': 'center',
                                                          'font-size': 16}),
                                           
@@ -325,28 +434,7 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                           html.H3('Company:'),
                                           
                                           dcc.Dropdown(id='company-dropdown', 
-                                                       options=[
-                                                          {'label': 'Apple : AAPL', 'value': 'AAPL'},
-                                                          {'label': 'Microsoft : MSFT', 'value': 'MSFT'},
-                                                          {'label': 'Alphabet (CLass A) : GOOGL', 'value': 'GOOGL'},
-                                                          {'label': 'Alphabet (Class C) : GOOG', 'value': 'GOOG'},
-                                                          {'label': 'Amazon : AMZN', 'value': 'AMZN'},
-                                                          {'label': 'Tesla : TSLA', 'value': 'TSLA'},
-                                                          {'label': 'Berkshire Hathaway (Class B) : BRK-B', 'value': 'BRK-B'},
-                                                          {'label': 'NVIDIA : NVDA', 'value': 'NVDA'},
-                                                          {'label': 'Meta (Class A) : META', 'value': 'META'},
-                                                          {'label': 'UnitedHealth : UNH', 'value': 'UNH'},
-                                                          {'label': 'Visa : V', 'value': 'V'},
-                                                          {'label': 'Johnson & Johnson : JNJ', 'value': 'JNJ'},
-                                                          {'label': 'Walmart : WMT', 'value': 'WMT'},
-                                                          {'label': 'JPMorgan Chase & Co. : JPM', 'value': 'JPM'},
-                                                          {'label': 'The Procter & Gamble Company : PG', 'value': 'PG'},
-                                                          {'label': 'Mastercard Incorporated : MA', 'value': 'MA'},
-                                                          {'label': 'Bank of America Corporation : BAC', 'value': 'BAC'},
-                                                          {'label': 'Exxon Mobil Corporation : XOM', 'value': 'XOM'},
-                                                          {'label': 'The Home Depot : HD', 'value': 'HD'},
-                                                          {'label': 'Chevron Corporation : CVX', 'value': 'CVX'}
-                                                          ],
+                                                       options=company_options,
                                                        value='AAPL',
                                                        placeholder='no selection',
                                                        searchable=True,
@@ -356,8 +444,11 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                           #custom ticker input/button
                                           dcc.Input(id='custom-ticker',
                                                     value='',
+                                                    list='symbol-suggestions',
                                                     style={'width':'5%'}),
+                                          html.Datalist(id='symbol-suggestions'),
                                           html.Button('Add Symbol & Run', id='button', n_clicks=0),
+                                          html.Div(id='ticker-message'),
                                           ###
                                           
                                           html.Br(),
@@ -367,12 +458,23 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                           dcc.RangeSlider(id='year-slider', 
                                                           min=1993, max=2022, step=1,
                                                           marks={int(n) : {'label' : str(n), 'style':{'color':'#ffffff'}} for n in range(1993, 2023)},
-                                                          value=[2018, 2022]
+                                                          value=list(default_year_range)
                                                           ),
                                           
                                           html.Br(),
                                           
+                                          html.Div(id='load-progress'),
+                                          dcc.Store(id='load-job'),
+                                          dcc.Store(id='ticker-data'),
+                                          dcc.Store(id='price-state'),
+                                          dcc.Store(id='info-state'),
+                                          dcc.Store(id='financials-state'),
+                                          dcc.Store(id='balance-sheet-state'),
+                                          dcc.Interval(id='load-poll', interval=500, disabled=True),
+                                          
                                           html.Div(dcc.Graph(id='historical-close-price-chart')),
+                                          dcc.Store(id='price-store'),
+                                          dcc.Store(id='price-request'),
                                           
                                           html.Div(children=(
                                               html.Div(dcc.Graph(id='historical-financials-chart')),
@@ -390,6 +492,21 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                               style={'columnCount':2, 'column-gap':'0px', 'margin-bottom':25}
                                           ),
                                           
+                                          html.H3('Compare:'),
+                                          
+                                          dcc.Dropdown(id='compare-dropdown',
+                                                       options=company_options,
+                                                       value=[],
+                                                       multi=True,
+                                                       placeholder='pick tickers to compare',
+                                                       style={'width': '50%', 'color':'#111111'}
+                                                       ),
+                                          
+                                          dcc.Store(id='compare-job'),
+                                          dcc.Interval(id='compare-poll', interval=500, disabled=True),
+                                          html.Div(dcc.Graph(id='compare-price-chart')),
+                                          html.Div(dcc.Graph(id='compare-financials-chart')),
+                                          
                                           html.Br(),
                                           
                                           html.Hr(),
@@ -423,27 +540,405 @@ app.layout = html.Div(children=[html.Div(children=[html.A("Big Ol' Buffalo Detec
                                                  'padding-top':50})
                                 ])
 
-#callback function for getting data and building plots
-@app.callback([Output(component_id='historical-close-price-chart', component_property='figure'),
-              Output(component_id='historical-financials-chart', component_property='figure'),
-              Output(component_id='info-text', component_property='children'),
-              Output(component_id='balance-sheet-bar-chart', component_property='figure'),
-              Output(component_id='balance-sheet-sunburst-chart', component_property='figure')],
+#built figures, keyed by panel/ticker/range and invalidated by the version of the data they came from
+figures = FigureCache()
+
+#background warm-up of every dropdown ticker (set STOCK_WARMUP=0 to turn it off, e.g. for scripts)
+def buildFigures(ticker): # pre-build the panels a first click on ticker would show, from the cache only
+    # anything that isn't cached (or went stale since) is left for the warm-up to fetch, throttled
+    if datasetReady(ticker, 'info') and datasetReady(ticker, 'prices', priceYears(default_year_range)):
+        priceStore(ticker, list(default_year_range))
+    if datasetReady(ticker, 'financials'):
+        financialsFigure(ticker)
+    if datasetReady(ticker, 'balance_sheet'):
+        balanceSheetFigures(ticker)
+
+warmup = WarmupScheduler([option['value'] for option in company_options], build=buildFigures)
+
+#per-request profiling: on for every request with STOCK_PROFILE=1. with STOCK_PROFILE_SWITCH=1 it can
+#also be switched with /profiling?enable=1, or asked for on a single request with an X-Profile: 1 header -
+#off by default, those are open to anybody who can reach the site. top functions go to cache/profiles/,
+#only the newest PROFILE_KEEP files are kept
+PROFILE_KEEP = 200
+profile_dir = os.path.join(CACHE_DIR, 'profiles')
+profiling = {'enabled': os.environ.get('STOCK_PROFILE', '0') == '1'}
+profile_switch = os.environ.get('STOCK_PROFILE_SWITCH', '0') == '1'
+
+#user requests take priority over background fetches, and get timed (and maybe profiled)
+@app.server.before_request
+def userRequestStarted():
+    if request.path.startswith('/_dash-update-component'):
+        g.user_request = True
+        g.request_start = time.perf_counter()
+        warmup.userRequestStarted()
+    if profiling['enabled'] or (profile_switch and request.headers.get('X-Profile') == '1'):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError: # another request's profiler is running on this interpreter
+            pass
+
+@app.server.teardown_request
+def userRequestFinished(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        name = '%d-%s.txt' % (time.time() * 1000, request.path.strip('/').replace('/', '_') or 'index')
+        with open(os.path.join(profile_dir, name), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+        for old in sorted(os.listdir(profile_dir))[:-PROFILE_KEEP]: # names start with the time, oldest first
+            try:
+                os.remove(os.path.join(profile_dir, old))
+            except FileNotFoundError: # another worker got there first
+                pass
+    if g.pop('user_request', False):
+        registry.observe('dash_update_component', time.perf_counter() - g.request_start)
+        warmup.userRequestFinished()
+
+#compress anything worth it (callback payloads mostly) - brotli when it's installed and the browser
+#takes it, gzip otherwise
+COMPRESS_MIN_BYTES = 1400 # about one packet, smaller isn't worth the CPU
+compressible = ('application/json', 'text/html', 'text/plain')
+response_bytes = {'raw': 0, 'sent': 0}
+
+@app.server.after_request
+def compressResponse(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in compressible):
+        return response
+    data = response.get_data()
+    response_bytes['raw'] += len(data)
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = None
+    if len(data) >= COMPRESS_MIN_BYTES:
+        with timed('compress'):
+            if brotli is not None and 'br' in accepted:
+                data, encoding = brotli.compress(data, quality=5), 'br'
+            elif 'gzip' in accepted:
+                data, encoding = gzip.compress(data, compresslevel=5), 'gzip'
+    response_bytes['sent'] += len(data)
+    if encoding is not None:
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.server.route('/profiling')
+def profilingToggle():
+    if not profile_switch:
+        abort(404)
+    if 'enable' in request.args:
+        profiling['enabled'] = request.args['enable'] == '1'
+    return jsonify(profiling)
+
+#latency histograms per stage and cache hit ratios, prometheus text format (this worker only)
+registry.gauge('stock_data_cache_hit_ratio', lambda: hitRatio(cache.hits, cache.misses))
+registry.gauge('stock_figure_cache_hit_ratio', lambda: hitRatio(figures.hits, figures.misses))
+registry.gauge('stock_figure_cache_bytes', lambda: figures.size)
+registry.gauge('stock_upstream_calls_total', lambda: cache.counters()['upstream_calls'])
+registry.gauge('stock_upstream_calls_saved_total', lambda: cache.counters()['saved_calls'])
+registry.gauge('stock_response_bytes_total', lambda: response_bytes['raw'])
+registry.gauge('stock_response_bytes_sent_total', lambda: response_bytes['sent'])
+
+@app.server.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain')
+
+#status page - what's warm, stale or in flight
+@app.server.route('/warmup')
+def warmupStatus():
+    return jsonify(warmup.status())
+
+#upstream calls made vs saved by single-flight coalescing (all workers), and this worker's stage latencies
+@app.server.route('/cache-stats')
+def cacheStats(): # cache counters plus rough per-stage latencies (bucket upper bounds, seconds)
+    return jsonify(dict(cache.counters(), stages=registry.summary()))
+
+#callback functions for getting data and building plots. anything not cached yet is loaded by a
+#background job (jobs.py) that the page polls, so dash workers never sit on a yahoo request.
+#ticker-data says which of the selected ticker's datasets are ready, each panel draws from the cache
+#as soon as its own dataset is. every panel listens to its own <panel>-state store, which is only
+#rewritten when that panel's state changes - a poll marking some other dataset ready, or the slider
+#widening the price range, doesn't redraw the other panels. the warm-up holds off while any of them load
+loads = JobQueue(started=warmup.userRequestStarted, finished=warmup.userRequestFinished)
+
+panel_datasets = {'price': ('info', 'prices'),
+                  'info': ('info',),
+                  'financials': ('financials',),
+                  'balance-sheet': ('balance_sheet',)}
+
+def loadProgress(ticker, wanted, ready, failed): # progress bar + what's still coming, or what went wrong
+    pending = [dataset for dataset in wanted if dataset not in ready and dataset not in failed]
+    children = []
+    if pending:
+        children += [html.Progress(value=str(len(wanted) - len(pending)), max=str(len(wanted))),
+                     ' Loading %s: %s...' % (ticker, ', '.join(pending))]
+    if failed:
+        children.append(html.P("Couldn't load %s for %s" % (', '.join(failed), ticker)))
+    return children
+
+@app.callback([Output(component_id='load-job', component_property='data'),
+               Output(component_id='ticker-data', component_property='data'),
+               Output(component_id='load-poll', component_property='disabled'),
+               Output(component_id='load-progress', component_property='children')] +
+              [Output(component_id=panel + '-state', component_property='data') for panel in panel_datasets],
               [Input(component_id='company-dropdown', component_property='value'),
-               Input(component_id='year-slider', component_property='value')])
+               Input(component_id='price-request', component_property='data'),
+               Input(component_id='load-poll', component_property='n_intervals')],
+              [State(component_id='load-job', component_property='data'),
+               State(component_id='ticker-data', component_property='data')])
+
+def loadData(ticker, price_request, n_intervals, job, ticker_data):
+    triggers = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if triggers == ['load-poll.n_intervals']:
+        if not job:
+            return [dash.no_update, dash.no_update, True, dash.no_update] + [dash.no_update] * len(panel_datasets)
+        status = loads.status(job['id'])
+        if status is None: # started by another worker, go by what's in the (shared) cache
+            ready = [dataset for dataset in job['datasets'] if datasetReady(job['ticker'], dataset, job['years'])]
+            failed = {} if time.time() - job['started'] < loads.timeout else \
+                     {dataset: 'timed out' for dataset in job['datasets'] if dataset not in ready}
+            status = {'ready': ready, 'failed': failed, 'done': len(ready) + len(failed) == len(job['datasets'])}
+        ready = ticker_data['ready'] + [dataset for dataset in status['ready'] if dataset not in ticker_data['ready']]
+        new_data = dict(ticker_data, ready=ready, failed=status['failed'])
+        progress = loadProgress(job['ticker'], ticker_data['wanted'], ready, status['failed'])
+        if new_data == ticker_data: # nothing new, don't redraw the panels
+            return [dash.no_update, dash.no_update, status['done'], progress] + [dash.no_update] * len(panel_datasets)
+        return [dash.no_update, new_data, status['done'], progress] + panelSignals(ticker_data, new_data)
+
+    #new ticker or price range: drop whatever the last selection still had going
+    if job:
+        loads.cancel(job['id'])
+    years = load_years = None # the browser already has the prices it needs
+    if price_request and price_request['ticker'] == ticker:
+        years = price_request['years']
+        load_years = priceYears(years) # what priceStore will read, so it never has to go upstream itself
+    wanted = [dataset for dataset in datasets if dataset != 'prices' or years is not None]
+    missing = [dataset for dataset in wanted if not datasetReady(ticker, dataset, load_years)]
+    new_data = {'ticker': ticker, 'years': years, 'wanted': wanted,
+                'ready': [dataset for dataset in wanted if dataset not in missing], 'failed': {}}
+    if not missing: # all cached, draw everything now
+        return [None, new_data, True, []] + panelSignals(ticker_data, new_data)
+    job = {'id': loads.submit(ticker, load_years, missing), 'ticker': ticker, 'years': load_years,
+           'datasets': missing, 'started': time.time()}
+    return [job, new_data, False, loadProgress(ticker, wanted, new_data['ready'], {})] + \
+           panelSignals(ticker_data, new_data)
+
+def panelState(ticker_data, *names): # 'ready', a placeholder message, or None to leave the panel alone
+    if not ticker_data:
+        return None
+    failed = [dataset for dataset in names if dataset in ticker_data['failed']]
+    if failed:
+        return "Couldn't load %s for %s" % (', '.join(failed), ticker_data['ticker'])
+    if all(dataset in ticker_data['ready'] for dataset in names):
+        return 'ready'
+    return 'Loading %s...' % ticker_data['ticker']
+
+def panelSignal(ticker_data, panel): # what one panel draws: {'ticker', 'state'} (+ 'years' for prices)
+    if not ticker_data:
+        return None
+    signal = {'ticker': ticker_data['ticker'], 'state': panelState(ticker_data, *panel_datasets[panel])}
+    if panel == 'price':
+        signal['years'] = ticker_data['years']
+        signal['failed'] = any(dataset in ticker_data['failed'] for dataset in panel_datasets[panel])
+    return signal
+
+def panelSignals(old, new): # every panel's signal for new, no_update for those that are the same as in old
+    signals = []
+    for panel in panel_datasets:
+        signal = panelSignal(new, panel)
+        signals.append(dash.no_update if signal == panelSignal(old, panel) else signal)
+    return signals
+
+#price chart: the browser holds the selected ticker's history (price-store) and re-windows it itself
+#on slider moves and zooms (assets/price_window.js). the server is only asked (price-request) when the
+#ticker changes or the slider goes outside the years already in the store
+app.clientside_callback(
+    ClientsideFunction(namespace='prices', function_name='request'),
+    Output(component_id='price-request', component_property='data'),
+    [Input(component_id='company-dropdown', component_property='value'),
+     Input(component_id='year-slider', component_property='value')],
+    State(component_id='price-store', component_property='data'))
+
+app.clientside_callback(
+    ClientsideFunction(namespace='prices', function_name='render'),
+    Output(component_id='historical-close-price-chart', component_property='figure'),
+    [Input(component_id='price-store', component_property='data'),
+     Input(component_id='year-slider', component_property='value'),
+     Input(component_id='historical-close-price-chart', component_property='relayoutData')])
+
+@app.callback(Output(component_id='price-store', component_property='data'),
+              Input(component_id='price-state', component_property='data'),
+              State(component_id='price-store', component_property='data'))
+
+def updatePrices(signal, store):
+    if signal is None or signal['years'] is None:
+        return dash.no_update
+    if signal['failed']: # no years, so the next slider move asks again
+        return {'ticker': signal['ticker'], 'years': None, 'placeholder': placeholderFigure(signal['state'])}
+    if signal['state'] != 'ready':
+        return dash.no_update # the chart keeps what it has until the new prices land
+    if store and [store['ticker'], store['years']] == [signal['ticker'], signal['years']]:
+        return dash.no_update # already sent
+    return priceStore(signal['ticker'], signal['years'])
+
+# figures are cached under the version of the data they were built from, read before and after the
+# data itself. if the two reads differ a refresh landed in between and there's no telling which
+# version the data is - the figure is still returned, just not cached (the next view caches it)
+def versionedFigure(key, version, load, build): # version() -> current data version, build(*load())
+    before = version()
+    data = load()
+    if version() != before:
+        return build(*data)
+    return figures.fetch(key, before, lambda: build(*data))
+
+def priceStore(ticker, year_range):
+    return versionedFigure(('price-store', ticker) + tuple(year_range),
+                           lambda: dataVersion(ticker, 'info', 'prices'),
+                           lambda: (getInfo(ticker), getPrices(ticker, priceYears(year_range))),
+                           lambda info, prices: priceData(ticker, info, prices, year_range))
 
-def everything(ticker, year_range):
-    prices, info, reduced_financials, balance_sheet = getData(ticker, year_range)
-    price_chart = priceChart(info, prices)
-    financials_chart = financialsTimeline(reduced_financials)
-    text = printInfo(info)
-    bs_bar, bs_sunburst = balanceSheetPlots(balance_sheet)
-    return price_chart, financials_chart, text, bs_bar, bs_sunburst
+@app.callback(Output(component_id='historical-financials-chart', component_property='figure'),
+              Input(component_id='financials-state', component_property='data'))
+
+def updateFinancials(signal):
+    if signal is None:
+        return dash.no_update
+    if signal['state'] != 'ready':
+        return placeholderFigure(signal['state'])
+    return financialsFigure(signal['ticker'])
+
+def financialsFigure(ticker):
+    return versionedFigure(('financials', ticker),
+                           lambda: dataVersion(ticker, 'financials'),
+                           lambda: (getFinancials(ticker),),
+                           financialsTimeline)
+
+@app.callback(Output(component_id='info-text', component_property='children'),
+              Input(component_id='info-state', component_property='data'))
+
+def updateInfo(signal):
+    if signal is None:
+        return dash.no_update
+    if signal['state'] != 'ready':
+        return '*%s*' % signal['state']
+    return printInfo(getInfo(signal['ticker']))
+
+@app.callback([Output(component_id='balance-sheet-bar-chart', component_property='figure'),
+               Output(component_id='balance-sheet-sunburst-chart', component_property='figure')],
+              Input(component_id='balance-sheet-state', component_property='data'))
+
+def updateBalanceSheet(signal):
+    if signal is None:
+        return dash.no_update, dash.no_update
+    if signal['state'] != 'ready':
+        return placeholderFigure(signal['state']), placeholderFigure(signal['state'])
+    return balanceSheetFigures(signal['ticker'])
+
+def balanceSheetFigures(ticker):
+    return versionedFigure(('balance_sheet', ticker),
+                           lambda: dataVersion(ticker, 'balance_sheet'),
+                           lambda: (getBalanceSheet(ticker),),
+                           balanceSheetPlots)
+
+#comparison mode: prices for every picked ticker come down in one batched download and are
+#charted from one aligned frame (the year slider applies here too). like the single ticker panels,
+#anything not cached yet is loaded by a background job the page polls - one job for the whole
+#selection, so the prices still come down as one batch
+def loadComparison(tickers, dataset, year_range): # JobQueue load for a tuple of tickers
+    if dataset == 'prices':
+        getCloses(list(tickers), year_range)
+    else:
+        getFinancialsMany(tickers)
+
+compare_loads = JobQueue(loadComparison, workers=2, # a job is already a batch
+                         started=warmup.userRequestStarted, finished=warmup.userRequestFinished)
+
+def comparisonMissing(tickers, year_range): # what a comparison still has to load before it draws
+    missing = []
+    if not all(datasetReady(ticker, 'prices', priceYears(year_range)) for ticker in tickers):
+        missing.append('prices')
+    if not all(datasetReady(ticker, 'financials') for ticker in tickers):
+        missing.append('financials')
+    return missing
+
+@app.callback([Output(component_id='compare-price-chart', component_property='figure'),
+               Output(component_id='compare-financials-chart', component_property='figure'),
+               Output(component_id='compare-job', component_property='data'),
+               Output(component_id='compare-poll', component_property='disabled')],
+              [Input(component_id='compare-dropdown', component_property='value'),
+               Input(component_id='year-slider', component_property='value'),
+               Input(component_id='compare-poll', component_property='n_intervals')],
+              State(component_id='compare-job', component_property='data'))
+
+def updateComparison(tickers, year_range, n_intervals, job):
+    triggers = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if not tickers:
+        if triggers == ['year-slider.value']: # nothing on the charts to re-window
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        if job:
+            compare_loads.cancel(job['id'])
+        message = 'Pick tickers above to compare them'
+        return placeholderFigure(message), placeholderFigure(message), None, True
+    tickers = list(dict.fromkeys(tickers))
+    if triggers == ['compare-poll.n_intervals']:
+        if not job:
+            return dash.no_update, dash.no_update, dash.no_update, True
+        status = compare_loads.status(job['id'])
+        if status is None: # started by another worker, go by what's in the (shared) cache
+            timed_out = time.time() - job['started'] >= compare_loads.timeout
+            prices_ready = 'prices' not in comparisonMissing(tickers, year_range)
+            status = {'failed': {} if prices_ready or not timed_out else {'prices': 'timed out'},
+                      'done': prices_ready or timed_out} # financials a ticker doesn't have never turn up
+        if not status['done']:
+            return dash.no_update, dash.no_update, dash.no_update, False
+        if 'prices' in status['failed']:
+            message = "Couldn't load prices for %s" % ', '.join(tickers)
+            return placeholderFigure(message), placeholderFigure(message), None, True
+        return comparisonFigures(tickers, year_range) + (None, True)
+
+    #new selection or price range: drop whatever the last one still had going
+    if job:
+        compare_loads.cancel(job['id'])
+    missing = comparisonMissing(tickers, year_range)
+    if not missing:
+        return comparisonFigures(tickers, year_range) + (None, True)
+    job = {'id': compare_loads.submit(tuple(tickers), priceYears(year_range), missing), 'started': time.time()}
+    message = 'Loading %s...' % ', '.join(tickers)
+    return placeholderFigure(message), placeholderFigure(message), job, False
+
+def comparisonData(tickers, year_range): # cached closes and financials only - None for a ticker with no reports
+    financials = dict.fromkeys(tickers)
+    financials.update(getFinancialsMany([ticker for ticker in tickers if datasetReady(ticker, 'financials')]))
+    return getCloses(tickers, priceYears(year_range)), financials
+
+def comparisonFigures(tickers, year_range):
+    return versionedFigure(('compare',) + tuple(tickers) + tuple(year_range),
+                           lambda: tuple(dataVersion(ticker, 'prices', 'financials') for ticker in tickers),
+                           lambda: comparisonData(tickers, year_range),
+                           lambda closes, financials: (comparePriceChart(closes, year_range),
+                                                       compareFinancials(financials)))
+
+@app.callback(Output(component_id='compare-dropdown', component_property='options'),
+              Input(component_id='company-dropdown', component_property='options'))
+
+def compareOptions(options): # custom tickers can be compared too
+    return options
+
+#search-as-you-type for the custom ticker box
+@app.callback(Output(component_id='symbol-suggestions', component_property='children'),
+              Input(component_id='custom-ticker', component_property='value'))
+
+def suggestSymbols(query):
+    return [html.Option(value=match['symbol'], label=match['name']) for match in symbols.search(query or '')]
 
 #callback function to add new ticker to list (consequently runs plots)
 @app.callback(
     [Output(component_id='company-dropdown', component_property='value'),
-    Output(component_id='company-dropdown', component_property='options')],
+    Output(component_id='company-dropdown', component_property='options'),
+    Output(component_id='ticker-message', component_property='children')],
     [Input(component_id='button', component_property='n_clicks'),
      Input(component_id='company-dropdown', component_property='options')],
     State(component_id='custom-ticker', component_property='value')
@@ -453,11 +948,28 @@ def altTick(click, pick, tick): # too. much. fun.
 #click=n_clicks, pick='options' picklist, tick=new ticker symbol
     if tick == '':
         tick='AAPL'
+    tick = normalize(tick)
+    message = ''
     if click > 0:
-        if tick not in [dic['value'] for dic in pick]:
-            #name = yf.Ticker(tick).info['shortName'] #cool idea but takes too long
-            pick.append({'label': tick, 'value': tick})
-    return tick, pick
+        if tick not in {dic['value'] for dic in pick}:
+            if symbols.complete and tick not in symbols:
+                matches = [match['symbol'] for match in symbols.search(tick, 3)]
+                suggest = ' - did you mean %s?' % ', '.join(matches) if matches else ''
+                if usLooking(tick): # the full US listing doesn't have it - a typo, no point asking yahoo
+                    return dash.no_update, dash.no_update, '%s isn\'t a listed symbol%s' % (tick, suggest)
+                # indices, crypto, other exchanges aren't indexed - yahoo may well know them
+                message = '%s isn\'t a US listing%s' % (tick, suggest)
+            pick.append({'label': symbols.label(tick), 'value': tick})
+            warmup.add(tick)
+    return tick, pick, message
+
+#start warming up once the callbacks it builds figures with exist, and fetch the symbol list if
+#there isn't one yet
+if os.environ.get('STOCK_WARMUP', '1') != '0':
+    warmup.start()
+    symbols.start()
+else:
+    symbols.load()
 
 #run
 if __name__ == '__main__':
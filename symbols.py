@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Ticker symbol index for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Symbol Index
+####
+
+# every listed US symbol (symbol -> name, exchange) in memory, so a custom ticker can be checked
+# and labelled instantly instead of finding out it doesn't exist after a 10s yahoo round trip.
+# the list lives in a local csv (cache/symbols.csv by default). it's built from NASDAQ Trader's symbol
+# directory - nasdaqlisted.txt + otherlisted.txt, every NASDAQ/NYSE/AMEX/ARCA/BATS listing - with
+#
+#   python symbols.py --update
+#
+# and the dashboard fetches it in the background on first start if there isn't one yet.
+# those lists cover US listings only - indices (^GSPC), currencies (EURUSD=X), crypto (BTC-USD) and
+# other exchanges (RY.TO) are never in them, so usLooking() says which symbols the index can vouch for
+
+# imports
+import os
+import csv
+import bisect
+import difflib
+import argparse
+import threading
+import urllib.request
+
+from stock_cache import CACHE_DIR
+
+SYMBOLS_PATH = os.environ.get('STOCK_SYMBOLS', os.path.join(CACHE_DIR, 'symbols.csv'))
+SYMBOL_SOURCES = {'nasdaqlisted': 'https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt',
+                  'otherlisted': 'https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt'}
+SEARCH_LIMIT = 10
+
+# otherlisted.txt exchange codes
+exchange_names = {'A': 'NYSE American', 'N': 'NYSE', 'P': 'NYSE Arca', 'Z': 'Cboe BZX', 'V': 'IEX'}
+
+# one-letter yahoo exchange suffixes (london, frankfurt, tsx venture, tokyo) - any other single letter
+# after a dot is a share class
+exchange_suffixes = ('L', 'F', 'V', 'T')
+
+fields = ['symbol', 'name', 'exchange']
+
+
+def normalize(symbol): # what yahoo calls it - 'brk.b ' -> 'BRK-B', but 'ry.to', 'vod.l', '^gspc' keep their form
+    symbol = symbol.strip().upper().replace('/', '-')
+    head, _, suffix = symbol.rpartition('.')
+    if head and len(suffix) == 1 and suffix not in exchange_suffixes: # share class
+        return head + '-' + suffix
+    return symbol
+
+def usLooking(symbol): # would a US listing look like this - no exchange suffix, not an index/currency/crypto
+    symbol = normalize(symbol)
+    return not ('.' in symbol or '=' in symbol or symbol.startswith('^') or symbol.endswith('-USD'))
+
+def shortName(name): # 'Apple Inc. - Common Stock' -> 'Apple Inc.'
+    return name.split(' - ')[0].strip()
+
+def parseSymbolDirectory(text, source): # rows from one NASDAQ Trader file (pipe separated, footer line)
+    rows = []
+    reader = csv.DictReader(text.splitlines(), delimiter='|')
+    for line in reader:
+        if line.get('Test Issue') == 'Y' or not line.get('Security Name'):
+            continue # test listings and the 'File Creation Time' footer
+        if source == 'nasdaqlisted':
+            symbol, exchange = line['Symbol'], 'NASDAQ'
+        else:
+            symbol, exchange = line['ACT Symbol'], exchange_names.get(line['Exchange'], line['Exchange'])
+        # US listings, so a dot is always a share class here
+        rows.append({'symbol': normalize(symbol.replace('.', '-')), 'name': shortName(line['Security Name']),
+                     'exchange': exchange})
+    return rows
+
+def downloadSymbols(path=SYMBOLS_PATH, timeout=30): # fetch both lists and write the csv, returns row count
+    rows = []
+    for source, url in SYMBOL_SOURCES.items():
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            rows += parseSymbolDirectory(response.read().decode('utf-8', 'replace'), source)
+    writeSymbols(rows, path)
+    return len(rows)
+
+def writeSymbols(rows, path=SYMBOLS_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + '.tmp', path) # readers never see half a file
+
+
+class SymbolIndex:
+    # symbols in a dict for lookups plus two sorted lists (symbols, lowercase names) that prefix
+    # searches bisect into - O(log n) per keystroke however long the list is. fuzzy matching (typos)
+    # only runs when no prefix matches, and only against symbols/first words of about the
+    # same length as the query
+    def __init__(self, path=SYMBOLS_PATH, seed=()):
+        self.path = path
+        self.seed = list(seed) # (symbol, name) pairs that are always known, e.g. the dropdown tickers
+        self.complete = False # True once the full listing is loaded - until then nothing is rejected
+        self._lock = threading.Lock()
+        self._set([])
+
+    def _set(self, rows):
+        entries = {row['symbol']: (row['name'], row['exchange']) for row in rows}
+        for symbol, name in self.seed:
+            entries.setdefault(normalize(symbol), (name, ''))
+        by_name = sorted((name.lower(), symbol) for symbol, (name, _) in entries.items() if name)
+        words = {} # first word of the name -> symbol, for fuzzy name matches
+        for name, symbol in reversed(by_name):
+            words[name.split()[0]] = symbol
+        with self._lock:
+            self.entries = entries
+            self.symbols = sorted(entries)
+            self.names = by_name
+            self._name_keys = [name for name, _ in by_name]
+            self._words = words
+            self._symbols_by_length = self._byLength(entries)
+            self._words_by_length = self._byLength(words)
+
+    def _byLength(self, keys):
+        by_length = {}
+        for key in keys:
+            by_length.setdefault(len(key), []).append(key)
+        return by_length
+
+    def _close(self, query, by_length, limit): # typo matches among keys within a character of query's length
+        candidates = [key for n in (len(query) - 1, len(query), len(query) + 1) for key in by_length.get(n, ())]
+        return difflib.get_close_matches(query, candidates, limit, 0.75)
+
+    def load(self): # False if there's no index file yet
+        try:
+            with open(self.path, newline='', encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+        except FileNotFoundError:
+            self._set([])
+            return False
+        self._set(rows)
+        self.complete = bool(rows)
+        return self.complete
+
+    def update(self): # download a fresh listing, then load it
+        downloadSymbols(self.path)
+        return self.load()
+
+    def start(self): # load the local index, fetching it first (in the background) if there isn't one
+        if not self.load():
+            threading.Thread(target=self._fetch, name='symbol-index', daemon=True).start()
+
+    def _fetch(self):
+        try:
+            self.update()
+        except Exception:
+            pass # offline - custom tickers just aren't checked until there's an index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, symbol):
+        return normalize(symbol) in self.entries
+
+    def lookup(self, symbol): # {'symbol', 'name', 'exchange'} or None
+        symbol = normalize(symbol)
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return None
+        return dict(zip(fields, (symbol,) + entry))
+
+    def label(self, symbol): # dropdown label, same style as company_options
+        entry = self.lookup(symbol)
+        if entry is None or not entry['name']:
+            return normalize(symbol)
+        return '%s : %s' % (entry['name'], entry['symbol'])
+
+    def _prefixed(self, keys, prefix, limit): # indices of keys starting with prefix (keys sorted)
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\uffff', start)
+        return range(start, min(end, start + limit))
+
+    def search(self, query, limit=SEARCH_LIMIT): # best matches for a partial symbol or company name
+        query = query.strip()
+        if not query:
+            return []
+        with self._lock:
+            symbols, names, name_keys, words = self.symbols, self.names, self._name_keys, self._words
+            symbols_by_length, words_by_length = self._symbols_by_length, self._words_by_length
+        found = []
+        for i in self._prefixed(symbols, normalize(query), limit): # 'AAP' -> AAP, AAPL, ... (exact first)
+            found.append(symbols[i])
+        for i in self._prefixed(name_keys, query.lower(), limit): # 'appl' -> Apple Inc., Applied ...
+            found.append(names[i][1])
+        if not found: # typos - 'APPL', 'microsft'
+            found += self._close(normalize(query), symbols_by_length, limit)
+            found += [words[word] for word in self._close(query.lower(), words_by_length, limit)]
+        return [self.lookup(symbol) for symbol in list(dict.fromkeys(found))[:limit]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or search the local ticker symbol index')
+    parser.add_argument('query', nargs='*', help='symbols or company names to look up')
+    parser.add_argument('--update', action='store_true', help='download the current listing from NASDAQ Trader')
+    parser.add_argument('--path', default=SYMBOLS_PATH, help='index file')
+    args = parser.parse_args(argv)
+
+    index = SymbolIndex(args.path)
+    if args.update:
+        print('%d symbols written to %s' % (downloadSymbols(args.path), args.path))
+    if not index.load():
+        raise SystemExit('no symbol index at %s - run with --update first' % args.path)
+    for query in args.query:
+        for match in index.search(query):
+            print('%-8s %-12s %s' % (match['symbol'], match['exchange'], match['name']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for colstore - versioned price histories
+
+@author: Jack Vance
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from colstore import ColumnStore, PRICE_STORE_KEEP
+
+
+def prices(days, start='2020-01-01'):
+    index = pd.bdate_range(start, periods=days, name='Date')
+    close = np.linspace(100, 200, days)
+    return pd.DataFrame({'Close': close, 'Volume': np.arange(days, dtype=np.int64)}, index=index)
+
+
+def test_round_trip(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    assert store.current('AAPL') is None
+    with pytest.raises(FileNotFoundError):
+        store.read('AAPL')
+    frame = prices(30)
+    version = store.write('AAPL', frame)
+    assert store.current('aapl') == version
+    read = store.read('AAPL')
+    assert read.index.equals(frame.index) # stored as days, read back at ns resolution
+    assert list(read.columns) == list(frame.columns)
+    for column in frame:
+        assert read[column].dtype == frame[column].dtype
+        np.testing.assert_array_equal(read[column], frame[column])
+    assert not read['Close'].to_numpy().flags.writeable # a mapped view, not a copy
+
+def test_float32(tmp_path):
+    store = ColumnStore(str(tmp_path), float32=True)
+    store.write('AAPL', prices(30))
+    frame = store.read('AAPL')
+    assert frame['Close'].dtype == np.float32
+    assert frame['Volume'].dtype == np.int64
+
+def test_versions(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    first = store.write('AAPL', prices(10))
+    old = store.read('AAPL', first)
+    second = store.write('AAPL', prices(20))
+    assert store.current('AAPL') == second != first
+    assert len(store.read('AAPL')) == 20
+    assert len(store.read('AAPL', first)) == 10 # readers of the old version aren't disturbed
+    for days in range(PRICE_STORE_KEEP):
+        store.write('AAPL', prices(30 + days))
+    assert len(old) == 10 # still mapped
+    with pytest.raises(FileNotFoundError): # pruned, as seen by a fresh process
+        ColumnStore(str(tmp_path)).read('AAPL', first)
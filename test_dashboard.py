@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the dashboard's chart helpers
+
+@author: Jack Vance
+"""
+import os
+import gzip
+import time
+import base64
+import threading
+
+import dash
+import numpy as np
+
+import stock_data
+from symbols import writeSymbols, SymbolIndex
+from jobs import JobQueue
+import stock_overview_dashboard_2024_02 as dashboard
+from stock_overview_dashboard_2024_02 import lttb, priceData, comparePriceChart, PRICE_POINT_BUDGET
+
+
+def test_lttb_short_series():
+    x = np.arange(10.0)
+    assert list(lttb(x, x, 10)) == list(range(10))
+    assert list(lttb(x, x, 50)) == list(range(10))
+    assert list(lttb(x, x, 2)) == list(range(10)) # can't keep less than the two ends
+
+def test_lttb_keeps_shape():
+    rng = np.random.default_rng(0)
+    x = np.arange(5000.0)
+    y = np.cumsum(rng.normal(0, 1, len(x)))
+    y[1234] += 500 # a spike every-nth sampling would almost surely miss
+    y[3456] -= 500
+    keep = lttb(x, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert (np.diff(keep) > 0).all()
+    assert 1234 in keep and 3456 in keep
+
+def test_lttb_one_point_per_bucket():
+    x = np.arange(1000.0)
+    keep = lttb(x, np.sin(x / 50), 100)
+    edges = np.linspace(1, 999, 99).astype(int)
+    assert (np.searchsorted(edges, keep[1:-1], side='right') == np.arange(1, 99)).all()
+
+def decode(array): # typed array spec -> numpy
+    return np.frombuffer(base64.b64decode(array['bdata']), dtype=array['dtype'])
+
+def test_price_data_full_resolution():
+    prices = stock_data.getPrices('LTTB', [1999, 2022])
+    data = priceData('LTTB', {'shortName': 'Lttb', 'symbol': 'LTTB'}, prices, [2000, 2022])
+    days = decode(data['x'])
+    close = decode(data['close'])
+    assert len(days) == len(close) == len(decode(data['ma200'])) > PRICE_POINT_BUDGET
+    assert np.datetime64(int(days[0]), 'D').astype(object).year == 2000 # the early year only warms the averages
+    assert not np.isnan(decode(data['ma200'])[0])
+    assert data['point_budget'] == PRICE_POINT_BUDGET # the browser downsamples to this
+
+def test_compare_chart_point_budget():
+    closes = stock_data.getCloses(['LTTB', 'LTTC'], [1995, 2022])
+    figure = comparePriceChart(closes, [1996, 2022])
+    assert {trace.type for trace in figure.data} == {'scattergl'} # long range, webgl
+    assert all(len(trace.x) <= PRICE_POINT_BUDGET for trace in figure.data)
+
+def test_metrics_page():
+    client = dashboard.app.server.test_client()
+    client.get('/_dash-layout')
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert text.startswith('# TYPE stock_stage_seconds histogram')
+    assert 'stock_response_bytes_total' in text
+    assert set(client.get('/cache-stats').json) >= {'upstream_calls', 'saved_calls', 'stages'}
+
+def test_compress_response():
+    client = dashboard.app.server.test_client()
+    plain = client.get('/_dash-layout')
+    assert 'Content-Encoding' not in plain.headers # not accepted
+    assert len(plain.data) >= dashboard.COMPRESS_MIN_BYTES
+    compressed = client.get('/_dash-layout', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+    small = client.get('/profiling', headers={'Accept-Encoding': 'gzip'}) # 404 page, left alone
+    assert small.status_code == 404 and 'Content-Encoding' not in small.headers
+
+def test_profiling_switch(monkeypatch, tmp_path):
+    client = dashboard.app.server.test_client()
+    monkeypatch.setattr(dashboard, 'profile_dir', str(tmp_path))
+    client.get('/metrics', headers={'X-Profile': '1'})
+    assert os.listdir(str(tmp_path)) == [] # off unless STOCK_PROFILE_SWITCH=1
+    monkeypatch.setattr(dashboard, 'profile_switch', True)
+    monkeypatch.setattr(dashboard, 'PROFILE_KEEP', 2)
+    for _ in range(4):
+        client.get('/metrics', headers={'X-Profile': '1'})
+    assert len(os.listdir(str(tmp_path))) == 2 # only the newest are kept
+    assert client.get('/profiling').json == {'enabled': False}
+
+def test_figures_cached_by_data_version(monkeypatch):
+    stock_data.getFinancials('VERS') # cold loads go through the job queue first
+    builds = []
+    monkeypatch.setattr(dashboard, 'financialsTimeline', lambda financials: builds.append(1) or {'data': []})
+    dashboard.financialsFigure('VERS')
+    dashboard.financialsFigure('VERS')
+    assert len(builds) == 1 # built once, then served from the figure cache
+    stock_data.refreshDataset('VERS', 'financials', None) # new data version
+    dashboard.financialsFigure('VERS')
+    assert len(builds) == 2
+
+def test_figure_not_cached_when_data_changes_underneath(monkeypatch):
+    stock_data.getFinancials('RACE')
+    def getFinancials(ticker): # a refresh lands while the figure reads its data
+        stock_data.refreshDataset(ticker, 'financials', None)
+        return stock_data.getFinancials(ticker)
+    monkeypatch.setattr(dashboard, 'getFinancials', getFinancials)
+    dashboard.financialsFigure('RACE')
+    assert ('financials', 'RACE') not in dashboard.figures._entries # neither version is safe to file it under
+    monkeypatch.setattr(dashboard, 'getFinancials', stock_data.getFinancials)
+    dashboard.financialsFigure('RACE')
+    assert dashboard.figures._entries[('financials', 'RACE')][0] == stock_data.dataVersion('RACE', 'financials')
+
+def test_alt_tick_checks_listing(tmp_path, monkeypatch):
+    path = str(tmp_path / 'symbols.csv')
+    writeSymbols([{'symbol': 'AAPL', 'name': 'Apple Inc.', 'exchange': 'NASDAQ'},
+                  {'symbol': 'MSFT', 'name': 'Microsoft Corporation', 'exchange': 'NASDAQ'}], path)
+    index = SymbolIndex(path)
+    warmed = []
+    monkeypatch.setattr(dashboard, 'symbols', index)
+    monkeypatch.setattr(dashboard.warmup, 'add', warmed.append)
+    options = [{'label': 'Microsoft Corporation : MSFT', 'value': 'MSFT'}]
+
+    assert dashboard.altTick(1, list(options), 'appl')[0] == 'APPL' # nothing to check against yet
+    assert index.load()
+    value, pick, message = dashboard.altTick(1, list(options), 'appl')
+    assert value is dash.no_update and pick is dash.no_update # a typo isn't added or warmed up
+    assert 'AAPL' in message
+    value, pick, message = dashboard.altTick(1, list(options), 'aapl')
+    assert value == 'AAPL' and pick[-1] == {'label': 'Apple Inc. : AAPL', 'value': 'AAPL'} and not message
+    value, pick, message = dashboard.altTick(1, list(options), 'vod.l') # other exchanges aren't indexed
+    assert value == 'VOD.L' and pick[-1]['value'] == 'VOD.L' and 'US listing' in message
+    assert warmed == ['APPL', 'AAPL', 'VOD.L']
+
+def compareCall(client, tickers, year_range, changed, n_intervals=None, job=None): # updateComparison over http
+    outputs = [('compare-price-chart', 'figure'), ('compare-financials-chart', 'figure'),
+               ('compare-job', 'data'), ('compare-poll', 'disabled')]
+    body = {'output': '..%s..' % '...'.join('%s.%s' % output for output in outputs),
+            'outputs': [{'id': id, 'property': prop} for id, prop in outputs],
+            'inputs': [{'id': 'compare-dropdown', 'property': 'value', 'value': tickers},
+                       {'id': 'year-slider', 'property': 'value', 'value': year_range},
+                       {'id': 'compare-poll', 'property': 'n_intervals', 'value': n_intervals}],
+            'state': [{'id': 'compare-job', 'property': 'data', 'value': job}],
+            'changedPropIds': [changed]}
+    response = client.post('/_dash-update-component', json=body)
+    assert response.status_code == 200
+    return {id: props.popitem()[1] for id, props in response.json['response'].items()}
+
+def test_comparison_loads_in_background(monkeypatch):
+    release = threading.Event()
+    def blockedLoad(tickers, dataset, year_range): # upstream stuck until the test lets it go
+        release.wait(5)
+        dashboard.loadComparison(tickers, dataset, year_range)
+    monkeypatch.setattr(dashboard, 'compare_loads', JobQueue(blockedLoad))
+    client = dashboard.app.server.test_client()
+    client.get('/_dash-layout')
+
+    assert compareCall(client, [], [2018, 2022], 'year-slider.value') == {} # nothing to redraw
+    update = compareCall(client, ['CMPA', 'CMPB'], [2018, 2022], 'compare-dropdown.value')
+    assert update['compare-poll'] is False and update['compare-job'] # answered without waiting on upstream
+    job = update['compare-job']
+    update = compareCall(client, ['CMPA', 'CMPB'], [2018, 2022], 'compare-poll.n_intervals', 1, job)
+    assert list(update) == ['compare-poll'] # still loading
+    release.set()
+    deadline = time.time() + 10
+    while 'compare-price-chart' not in update:
+        assert time.time() < deadline
+        time.sleep(0.05)
+        update = compareCall(client, ['CMPA', 'CMPB'], [2018, 2022], 'compare-poll.n_intervals', 2, job)
+    assert update['compare-job'] is None and update['compare-poll'] is True
+    assert len(update['compare-price-chart']['data']) == 4 # a close and an average per ticker
+    update = compareCall(client, ['CMPA', 'CMPB'], [2019, 2022], 'year-slider.value') # cached, drawn at once
+    assert update['compare-job'] is None and update['compare-price-chart']['data']
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for indicators
+
+@author: Jack Vance
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import IndicatorEngine, IndicatorCache, DEFAULT_INDICATORS, indicatorName
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(0)
+    index = pd.bdate_range('2015-01-01', periods=1500)
+    walk = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (len(index), 3)), axis=0))
+    frame = pd.DataFrame(walk, index=index, columns=['AAA', 'BBB', 'CCC'])
+    frame.iloc[:300, 2] = np.nan # listed later than the others
+    return frame
+
+
+def test_names():
+    assert indicatorName(('sma', 50)) == 'sma50'
+    assert indicatorName(('drawdown',)) == 'drawdown'
+    values = IndicatorEngine().compute(pd.DataFrame({'A': [1.0, 2.0, 3.0]}))
+    assert set(values) == {'sma50', 'sma200', 'ema20', 'volatility20', 'drawdown', 'rsi14',
+                           'bollinger20_upper', 'bollinger20_lower'}
+
+def test_values(closes):
+    values = IndicatorEngine().compute(closes)
+    close = closes['AAA']
+    pd.testing.assert_series_equal(values['sma50']['AAA'], close.rolling(50).mean())
+    assert values['sma200']['AAA'].iloc[:199].isna().all()
+    assert values['sma200']['AAA'].iloc[199] == pytest.approx(close.iloc[:200].mean())
+    ema = [close.iloc[0]]
+    for price in close.iloc[1:]:
+        ema.append(ema[-1] + 2 / 21 * (price - ema[-1]))
+    np.testing.assert_allclose(values['ema20']['AAA'], ema)
+    np.testing.assert_allclose(values['drawdown']['AAA'], close / np.maximum.accumulate(close) - 1)
+    assert (values['drawdown'].max() <= 0).all()
+    rsi = values['rsi14'].dropna()
+    assert ((rsi >= 0) & (rsi <= 100)).all().all()
+    upper, lower = values['bollinger20_upper'].iloc[319:], values['bollinger20_lower'].iloc[319:]
+    assert upper.notna().all().all() and (upper >= lower).all().all()
+
+def test_tickers_independent(closes): # one pass over the wide frame == each ticker on its own
+    together = IndicatorEngine().compute(closes)
+    for ticker in closes:
+        alone = IndicatorEngine().compute(closes[[ticker]])
+        for name, frame in alone.items():
+            pd.testing.assert_series_equal(together[name][ticker], frame[ticker])
+    assert together['sma50']['CCC'].iloc[:349].isna().all() # warms up from its first close
+
+def test_unsorted_and_unknown(closes):
+    shuffled = IndicatorEngine(DEFAULT_INDICATORS).compute(closes.sample(frac=1, random_state=1))
+    pd.testing.assert_frame_equal(shuffled['sma50'], IndicatorEngine().compute(closes)['sma50'], check_freq=False)
+    with pytest.raises(ValueError):
+        IndicatorEngine([('macd', 12)]).compute(closes)
+
+def assertSame(values, expected):
+    assert set(values) == set(expected)
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(values[name], frame, check_freq=False, rtol=1e-9)
+
+def test_update_matches_compute(closes):
+    engine = IndicatorEngine()
+    engine.compute(closes.iloc[:-20])
+    for start in range(len(closes) - 20, len(closes), 5): # a few closes at a time
+        engine.update(closes.iloc[start:start + 5])
+    assertSame(engine.values, IndicatorEngine().compute(closes))
+
+def test_update_revised_close(closes):
+    engine = IndicatorEngine()
+    revised = closes.copy()
+    revised.iloc[-1] *= 1.05 # intraday close moved since the last refresh
+    engine.compute(revised)
+    engine.update(closes.iloc[-1:])
+    assertSame(engine.values, IndicatorEngine().compute(closes))
+    with pytest.raises(ValueError):
+        engine.update(closes.iloc[:10]) # further back than the kept tail
+
+def test_add_tickers(closes):
+    engine = IndicatorEngine()
+    engine.compute(closes[['AAA', 'BBB']])
+    engine.addTickers(closes[['CCC']])
+    assertSame(engine.values, IndicatorEngine().compute(closes))
+
+def test_cache_extends(closes):
+    cache = IndicatorCache(min_cells=0)
+    cache.compute(closes.iloc[:-1])
+    assertSame(cache.compute(closes), IndicatorEngine().compute(closes)) # one new close
+    assert (cache.computed, cache.extended) == (1, 1)
+    gained = closes.assign(DDD=closes['AAA'] * 2)
+    assertSame(cache.compute(gained), IndicatorEngine().compute(gained)) # a ticker added to the comparison
+    assert cache.extended == 2
+
+def test_cache_recomputes_adjusted(closes):
+    cache = IndicatorCache(min_cells=0)
+    cache.compute(closes)
+    split = closes.copy()
+    split.iloc[:, 0] /= 2 # history adjusted for a split
+    assertSame(cache.compute(split), IndicatorEngine().compute(split))
+    assertSame(cache.compute(closes.iloc[100:]), IndicatorEngine().compute(closes.iloc[100:])) # later start
+    assert (cache.computed, cache.extended) == (3, 0)
+
+def test_cache_small_frames(closes): # not worth keeping an engine for
+    cache = IndicatorCache()
+    assertSame(cache.compute(closes), IndicatorEngine().compute(closes))
+    cache.compute(closes)
+    assert (cache.computed, cache.extended) == (0, 0)
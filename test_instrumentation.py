@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for instrumentation - histograms and the /metrics text
+
+@author: Jack Vance
+"""
+from instrumentation import Histogram, Registry, timed, hitRatio
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for seconds in [0.005] * 50 + [0.05] * 45 + [0.5] * 4 + [5.0]:
+        histogram.observe(seconds)
+    assert histogram.counts == [50, 45, 4, 1]
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.9) == 0.1
+    assert histogram.quantile(0.99) == 1.0
+    assert histogram.quantile(1.0) == float('inf')
+
+def test_render():
+    registry = Registry()
+    registry.observe('fetch_info', 0.2)
+    registry.observe('fetch_info', 3.0)
+    registry.gauge('stock_cache_hit_ratio', lambda: 0.75)
+    registry.gauge('stock_broken', lambda: 1 / 0) # skipped, not a 500
+    registry.gauge('stock_nothing_yet', lambda: None)
+    lines = registry.render().splitlines()
+    assert lines[0] == '# TYPE stock_stage_seconds histogram'
+    assert 'stock_stage_seconds_bucket{stage="fetch_info",le="0.1"} 0' in lines
+    assert 'stock_stage_seconds_bucket{stage="fetch_info",le="0.25"} 1' in lines # cumulative
+    assert 'stock_stage_seconds_bucket{stage="fetch_info",le="+Inf"} 2' in lines
+    assert 'stock_stage_seconds_count{stage="fetch_info"} 2' in lines
+    assert 'stock_stage_seconds_sum{stage="fetch_info"} 3.200000' in lines
+    assert 'stock_cache_hit_ratio 0.75' in lines
+    assert not [line for line in lines if 'broken' in line or 'nothing_yet' in line]
+
+def test_summary_and_timed():
+    registry = Registry()
+    @timed('build', registry)
+    def build():
+        return 'figure'
+    assert build() == 'figure'
+    with timed('serialize', registry):
+        pass
+    registry.observe('slow', 60.0)
+    summary = registry.summary()
+    assert summary['build'] == {'count': 1, 'p50': 0.001, 'p99': 0.001}
+    assert summary['serialize']['count'] == 1
+    assert summary['slow']['p99'] is None # past the last bucket
+    assert hitRatio(0, 0) is None and hitRatio(3, 1) == 0.75
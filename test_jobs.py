@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for jobs - background dataset loads
+
+@author: Jack Vance
+"""
+import time
+import threading
+
+from jobs import JobQueue
+from warmup import WarmupScheduler
+
+
+class BlockingLoad: # load(ticker, dataset, year_range) that waits to be let go
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.release = threading.Event()
+        self.started = []
+
+    def __call__(self, ticker, dataset, year_range):
+        self.started.append(dataset)
+        self.release.wait(5)
+        if dataset in self.fail:
+            raise KeyError(ticker)
+
+def waitFor(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_loads_hold_off_warmup():
+    warmup = WarmupScheduler()
+    load = BlockingLoad(fail=['info'])
+    queue = JobQueue(load, workers=2, started=warmup.userRequestStarted, finished=warmup.userRequestFinished)
+    job_id = queue.submit('AAPL', [2020, 2022], ['prices', 'info'])
+    waitFor(lambda: len(load.started) == 2)
+    assert warmup.busy == 2 # the warm-up yields while a job's datasets load
+    load.release.set()
+    waitFor(lambda: queue.status(job_id)['done'])
+    assert warmup.busy == 0 # failed loads are let go too
+    status = queue.status(job_id)
+    assert status['ready'] == ['prices'] and 'KeyError' in status['failed']['info']
+
+def test_cancel():
+    load = BlockingLoad()
+    queue = JobQueue(load, workers=1)
+    job_id = queue.submit('AAPL', [2020, 2022], ['prices', 'info', 'financials'])
+    waitFor(lambda: load.started)
+    queue.cancel(job_id)
+    assert queue.status(job_id)['done']
+    load.release.set()
+    waitFor(lambda: all(future.done() for future in queue.jobs[job_id].futures.values()))
+    job = queue.jobs[job_id]
+    # the dataset in flight finishes into the cache, the ones that hadn't started never run
+    assert job.state == {'prices': 'ready', 'info': 'cancelled', 'financials': 'cancelled'}
+    assert load.started == ['prices']
+    queue.cancel('unknown') # a job another worker started, or one long forgotten
+
+def test_timeout():
+    load = BlockingLoad()
+    queue = JobQueue(load, workers=1, timeout=0.2)
+    job_id = queue.submit('AAPL', [2020, 2022], ['prices', 'info'])
+    status = queue.status(job_id)
+    assert not status['done'] and not status['failed']
+    time.sleep(0.3)
+    status = queue.status(job_id)
+    assert status['done'] and set(status['failed']) == {'prices', 'info'}
+    assert status['failed']['prices'].startswith('timed out')
+    load.release.set()
+    assert queue.status('unknown') is None
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for providers - record/replay and synthetic data
+
+@author: Jack Vance
+"""
+import time
+import datetime
+
+import pandas as pd
+import pytest
+
+from providers import RecordReplayProvider, SyntheticProvider, syntheticTickers
+
+start, end = datetime.date(2021, 1, 1), datetime.date(2022, 1, 1)
+
+
+def synthetic(): # three years of history up to the end of the test range
+    return SyntheticProvider(years=3, end=datetime.date(2021, 12, 31))
+
+
+def test_record_replay_round_trip(tmp_path):
+    upstream = synthetic()
+    recorder = RecordReplayProvider(str(tmp_path), upstream=upstream)
+    recorded = {'prices': recorder.prices('AAPL', start, end),
+                'info': recorder.info('AAPL'),
+                'financials': recorder.financials('AAPL'),
+                'balance_sheet': recorder.balance_sheet('AAPL')}
+    recorder.pricesMany(['MSFT', 'GOOG'], start, end)
+    assert len(recorded['prices']) > 250
+
+    replay = RecordReplayProvider(str(tmp_path)) # offline from here on
+    pd.testing.assert_frame_equal(replay.prices('AAPL', start, end), recorded['prices'])
+    assert replay.info('AAPL') == recorded['info']
+    pd.testing.assert_frame_equal(replay.financials('AAPL'), recorded['financials'])
+    pd.testing.assert_frame_equal(replay.balance_sheet('AAPL'), recorded['balance_sheet'])
+    batch = replay.pricesMany(['MSFT', 'GOOG'], start, end)
+    pd.testing.assert_frame_equal(batch['GOOG'], upstream.prices('GOOG', start, end))
+    # a narrower range is sliced out of the recording
+    narrow = replay.prices('AAPL', datetime.date(2021, 6, 1), datetime.date(2021, 7, 1))
+    assert len(narrow) and narrow.index.min() >= pd.Timestamp(2021, 6, 1) and narrow.index.max() < pd.Timestamp(2021, 7, 1)
+
+def test_record_merges_price_ranges(tmp_path):
+    recorder = RecordReplayProvider(str(tmp_path), upstream=synthetic())
+    recorder.prices('AAPL', start, datetime.date(2021, 7, 1))
+    recorder.prices('AAPL', datetime.date(2021, 6, 1), end)
+    replayed = RecordReplayProvider(str(tmp_path)).prices('AAPL', start, end)
+    assert replayed.index.is_unique and replayed.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(replayed, synthetic().prices('AAPL', start, end), check_freq=False)
+
+def test_replay_missing(tmp_path):
+    replay = RecordReplayProvider(str(tmp_path))
+    with pytest.raises(LookupError):
+        replay.info('NOPE')
+    with pytest.raises(LookupError):
+        replay.prices('NOPE', start, end)
+    fallback = RecordReplayProvider(str(tmp_path), fallback=synthetic())
+    assert fallback.info('NOPE')['symbol'] == 'NOPE'
+
+def test_replay_latency(tmp_path):
+    RecordReplayProvider(str(tmp_path), upstream=synthetic()).info('AAPL')
+    replay = RecordReplayProvider(str(tmp_path), latency=0.2)
+    started = time.perf_counter()
+    replay.info('AAPL')
+    assert time.perf_counter() - started >= 0.2
+
+def test_synthetic():
+    provider = SyntheticProvider(years=10, end=datetime.date(2022, 12, 30))
+    prices = provider.prices('SYN0001', datetime.date(1990, 1, 1), datetime.date(2023, 1, 1))
+    assert len(prices) == 10 * 252 # any history length
+    assert (prices['High'] >= prices['Low']).all()
+    pd.testing.assert_frame_equal(prices, SyntheticProvider(years=10, end=datetime.date(2022, 12, 30))
+                                  .prices('SYN0001', datetime.date(1990, 1, 1), datetime.date(2023, 1, 1)))
+    assert not prices.equals(provider.prices('SYN0002', datetime.date(1990, 1, 1), datetime.date(2023, 1, 1)))
+    assert syntheticTickers(2) == ['SYN0001', 'SYN0002']
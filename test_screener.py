@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for screener - output and resume
+
+@author: Jack Vance
+"""
+import pandas as pd
+import pytest
+
+import screener
+
+
+@pytest.fixture
+def screened(monkeypatch): # symbols screenTicker was called with. BAD fails the first time round
+    calls = []
+    def screenTicker(ticker):
+        calls.append(ticker)
+        row = {field: None for field in screener.fields}
+        row.update(symbol=ticker, name=ticker.title(), price=1.0)
+        if ticker == 'BAD' and calls.count(ticker) == 1:
+            row['error'] = 'info: timed out'
+        return row
+    monkeypatch.setattr(screener, 'screenTicker', screenTicker)
+    return calls
+
+@pytest.mark.parametrize('name', ['screen.csv', 'screen.parquet'])
+def test_resume(tmp_path, screened, name):
+    out = str(tmp_path / name)
+    screener.screen(['AAPL', 'BAD', 'MSFT', 'AAPL'], out, workers=2, progress=False)
+    assert sorted(screened) == ['AAPL', 'BAD', 'MSFT'] # deduped
+    # a second run only redoes what failed, and appends its row
+    screener.screen(['AAPL', 'BAD', 'MSFT', 'GOOG'], out, workers=2, progress=False)
+    assert sorted(screened[3:]) == ['BAD', 'GOOG']
+    rows = pd.read_parquet(out) if name.endswith('.parquet') else pd.read_csv(out)
+    assert sorted(rows['symbol']) == ['AAPL', 'BAD', 'BAD', 'GOOG', 'MSFT']
+    assert rows['error'].notna().sum() == 1
+    # nothing left to do
+    screener.screen(['AAPL', 'BAD', 'MSFT', 'GOOG'], out, workers=2, progress=False)
+    assert len(screened) == 5
+    # unless asked to
+    screener.screen(['AAPL'], out, resume=False, progress=False)
+    assert screened[-1] == 'AAPL' and len(screened) == 6
+
+def test_screen_ticker_synthetic():
+    row = screener.screenTicker('AAPL')
+    assert row['symbol'] == 'AAPL'
+    assert set(row) <= set(screener.fields)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for stock_cache
+
+@author: Jack Vance
+"""
+import os
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+import stock_cache
+from stock_cache import TieredCache, FigureCache, MISSING
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = TieredCache(str(tmp_path / 'cache.sqlite'))
+    cache.set('fresh', 1, time.time() + 60)
+    cache.set('stale', 2, time.time() - 1)
+    assert cache.get('fresh') == 1
+    assert cache.get('stale') is MISSING
+    assert cache.peek('stale') == 2 # still there for status checks
+    # and the disk tier agrees once the memory tier is skipped
+    assert cache.get('fresh', reload=True) == 1
+    assert cache.get('stale', None, reload=True) is None
+
+def test_fetch_recomputes_after_expiry(tmp_path):
+    cache = TieredCache(str(tmp_path / 'cache.sqlite'))
+    calls = []
+    def compute():
+        calls.append(1)
+        return len(calls)
+    assert cache.fetch('key', compute, time.time() - 1) == 1 # stored already expired
+    assert cache.fetch('key', compute, time.time() + 60) == 2
+    assert cache.fetch('key', compute, time.time() + 60) == 2 # fresh now, from the cache
+    assert cache.fetch('key', compute, time.time() + 60, refresh=True) == 3
+    assert len(calls) == 3
+
+def test_survives_restart(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    TieredCache(path).set('info:AAPL', {'shortName': 'Apple'}, time.time() + 60)
+    assert TieredCache(path).get('info:AAPL') == {'shortName': 'Apple'} # a new process reads it off disk
+
+def test_size_eviction(tmp_path):
+    cache = TieredCache(str(tmp_path / 'cache.sqlite'), max_bytes=10000, memory_items=2)
+    for i in range(5):
+        cache.set('key%d' % i, b'x' * 3000, time.time() + 60)
+        time.sleep(0.01) # distinct access times
+    assert cache.get('key0', reload=True) is MISSING # least recently used go first
+    assert cache.get('key4', reload=True) == b'x' * 3000
+    assert cache._db().execute('SELECT SUM(size) FROM entries').fetchone()[0] <= 10000
+
+def test_single_flight(tmp_path):
+    cache = TieredCache(str(tmp_path / 'cache.sqlite'))
+    calls, results = [], []
+    started = threading.Event()
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return 'value'
+    def fetch():
+        results.append(cache.fetch('popular', slow, time.time() + 60))
+    first = threading.Thread(target=fetch)
+    first.start()
+    started.wait() # the rest arrive while the first is upstream
+    others = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    counters = cache.counters()
+    assert counters['upstream_calls'] == 1
+    assert counters['coalesced_threads'] == 4
+
+def fetchInProcess(path, go, results): # one worker process asking for the popular key
+    cache = TieredCache(path)
+    go.wait()
+    results.put(cache.fetch('popular', lambda: (time.sleep(0.5), os.getpid())[1], time.time() + 60))
+
+@pytest.mark.skipif(stock_cache.fcntl is None, reason='no flock, processes are not coalesced')
+def test_single_flight_across_processes(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    TieredCache(path) # create the db before the workers race for it
+    context = multiprocessing.get_context('fork')
+    go, results = context.Event(), context.Queue()
+    workers = [context.Process(target=fetchInProcess, args=(path, go, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    go.set()
+    values = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join()
+    assert len(set(values)) == 1 and values[0] in [worker.pid for worker in workers] # one did the fetch
+    counters = TieredCache(path).counters()
+    assert counters['upstream_calls'] == 1
+    assert counters['coalesced_processes'] == 3
+    assert counters['saved_calls'] == 3
+
+def test_figure_cache_versions():
+    figures = FigureCache()
+    builds = []
+    def build():
+        builds.append(1)
+        return {'data': [], 'layout': {'title': {'text': 'v%d' % len(builds)}}}
+    assert figures.fetch('chart', 1, build)['layout']['title']['text'] == 'v1'
+    assert figures.fetch('chart', 1, build)['layout']['title']['text'] == 'v1' # cached json
+    assert figures.fetch('chart', 2, build)['layout']['title']['text'] == 'v2' # newer data rebuilds
+    assert (figures.hits, figures.misses) == (1, 2)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for stock_data - price history gaps and merging
+
+@author: Jack Vance
+"""
+import time
+import datetime
+import threading
+
+import pandas as pd
+
+import stock_data
+from providers import SyntheticProvider
+from stock_data import historyGaps, mergeHistory, PRICE_TTL
+
+day = datetime.timedelta(days=1)
+today = datetime.date.today()
+
+
+def history(start, end, last=None, age=0):
+    return {'start': start, 'end': end, 'last': last, 'created': time.time() - age,
+            'updated': time.time() - age}
+
+def closes(start, end, value):
+    index = pd.bdate_range(start, end, inclusive='left', name='Date')
+    return pd.DataFrame({'Close': [float(value)] * len(index)}, index=index)
+
+
+def test_gaps_cold():
+    assert historyGaps(None, datetime.date(2020, 1, 1), datetime.date(2021, 1, 1)) == \
+        [(datetime.date(2020, 1, 1), datetime.date(2021, 1, 1))]
+
+def test_gaps_covered():
+    stored = history(datetime.date(2019, 1, 1), datetime.date(2022, 1, 1), datetime.date(2021, 12, 31))
+    assert historyGaps(stored, datetime.date(2020, 1, 1), datetime.date(2021, 1, 1)) == []
+    # a closed range stays good however old it is
+    stored = history(datetime.date(2019, 1, 1), datetime.date(2022, 1, 1), age=10 * PRICE_TTL)
+    assert historyGaps(stored, datetime.date(2020, 1, 1), datetime.date(2022, 1, 1)) == []
+
+def test_gaps_edges():
+    stored = history(datetime.date(2020, 1, 1), datetime.date(2021, 1, 1), datetime.date(2020, 12, 31))
+    assert historyGaps(stored, datetime.date(2019, 1, 1), datetime.date(2022, 1, 1)) == \
+        [(datetime.date(2019, 1, 1), datetime.date(2020, 1, 1)),
+         (datetime.date(2020, 12, 31), datetime.date(2022, 1, 1))] # last close is re-read
+
+def test_gaps_stale_tail():
+    end = today + day # ranges up to today end tomorrow, the last close may still be intraday
+    fresh = history(datetime.date(2020, 1, 1), end, today)
+    assert historyGaps(fresh, datetime.date(2020, 1, 1), end) == []
+    assert historyGaps(fresh, datetime.date(2020, 1, 1), end, refresh=True) == [(today, end)]
+    stale = history(datetime.date(2020, 1, 1), end, today, age=PRICE_TTL + 60)
+    assert historyGaps(stale, datetime.date(2020, 1, 1), end) == [(today, end)]
+
+def test_merge():
+    start, end = datetime.date(2020, 1, 1), datetime.date(2020, 3, 1)
+    merged = mergeHistory(None, start, end, [closes(start, end, 1)])
+    assert (merged['start'], merged['end']) == (start, end)
+    assert merged['prices'].index.is_monotonic_increasing
+
+    # an earlier range and an overlapping later one, the fresh fetch wins where they overlap
+    stored = dict(merged, created=merged['created'] - 100)
+    before = closes(datetime.date(2019, 12, 1), start, 2)
+    after = closes(datetime.date(2020, 2, 20), datetime.date(2020, 4, 1), 3)
+    merged = mergeHistory(stored, datetime.date(2019, 12, 1), datetime.date(2020, 4, 1), [after, before])
+    prices = merged['prices']
+    assert (merged['start'], merged['end']) == (datetime.date(2019, 12, 1), datetime.date(2020, 4, 1))
+    assert merged['created'] == stored['created'] # still the same history, only updated
+    assert prices.index.is_monotonic_increasing and prices.index.is_unique
+    assert (prices.loc[:'2019-12-31', 'Close'] == 2).all()
+    assert (prices.loc['2020-01-01':'2020-02-19', 'Close'] == 1).all()
+    assert (prices.loc['2020-02-20':, 'Close'] == 3).all()
+
+def test_merge_nothing_new():
+    start, end = datetime.date(2020, 1, 1), datetime.date(2020, 3, 1)
+    stored = mergeHistory(None, start, end, [closes(start, end, 1)])
+    merged = mergeHistory(stored, start, end, [closes(end, end, 9)]) # empty fetch, e.g. a holiday
+    pd.testing.assert_frame_equal(merged['prices'], stored['prices'])
+
+def upstreamCalls():
+    return stock_data.cache.counters()['upstream_calls']
+
+def test_slider_only_fetches_new_gaps():
+    before = upstreamCalls()
+    prices = stock_data.getPrices('GAPS', [2018, 2020])
+    assert upstreamCalls() - before == 1
+    assert prices.index[0].year == 2018 and prices.index[-1].year == 2020
+    stock_data.getPrices('GAPS', [2019, 2020]) # inside what's stored, sliced locally
+    assert upstreamCalls() - before == 1
+    widened = stock_data.getPrices('GAPS', [2015, 2020]) # just the prepended years
+    assert upstreamCalls() - before == 2
+    assert widened.index[0].year == 2015 and widened.index.is_unique
+
+
+class SlowProvider(SyntheticProvider): # every call takes `latency`, financials takes `slow`
+    def __init__(self, latency, slow):
+        super().__init__(years=5, latency=latency)
+        self.slow = slow
+        self.calls = []
+
+    def delay(self):
+        time.sleep(self.latency)
+
+    def prices(self, ticker, start, end):
+        self.calls.append('prices')
+        return super().prices(ticker, start, end)
+
+    def info(self, ticker):
+        self.calls.append('info')
+        return super().info(ticker)
+
+    def financials(self, ticker):
+        self.calls.append('financials')
+        time.sleep(self.slow)
+        return super().financials(ticker)
+
+    def balance_sheet(self, ticker):
+        self.calls.append('balance_sheet')
+        return super().balance_sheet(ticker)
+
+def test_get_data_concurrent(monkeypatch):
+    provider = SlowProvider(latency=0.3, slow=0)
+    monkeypatch.setattr(stock_data, 'provider', provider)
+    started = time.perf_counter()
+    prices, info, reduced_financials, balance_sheet = stock_data.getData('CONC', [2022, 2023])
+    assert time.perf_counter() - started < 0.9 # about the slowest request, not the sum of four
+    assert len(prices) and info['symbol'] == 'CONC'
+    assert list(reduced_financials.columns) == stock_data.reduced_financials_keys
+    assert len(balance_sheet)
+    assert sorted(provider.calls) == sorted(stock_data.datasets) # each one exactly once
+
+def test_get_data_partial_on_timeout(monkeypatch):
+    provider = SlowProvider(latency=0, slow=2.0)
+    monkeypatch.setattr(stock_data, 'provider', provider)
+    started = time.perf_counter()
+    prices, info, reduced_financials, balance_sheet = stock_data.getData('SLOW', [2022, 2023], timeout=1.0)
+    assert time.perf_counter() - started < 1.5
+    assert reduced_financials is None # gave up on it...
+    assert prices is not None and info is not None and balance_sheet is not None
+    deadline = time.time() + 5
+    while not stock_data.datasetReady('SLOW', 'financials') and time.time() < deadline:
+        time.sleep(0.05)
+    assert stock_data.datasetReady('SLOW', 'financials') # ...but it still lands in the cache
+    assert provider.calls.count('financials') == 1
+
+def test_batched_prices_coalesce(monkeypatch): # a compare and a single-ticker load of the same prices
+    provider = SlowProvider(latency=0.3, slow=0)
+    monkeypatch.setattr(stock_data, 'provider', provider)
+    before = stock_data.cache.counters()
+    batch = threading.Thread(target=stock_data.getCloses, args=(['BATA', 'BATB'], [2022, 2023]))
+    batch.start()
+    time.sleep(0.1) # the batch holds both tickers' history locks by now
+    prices = stock_data.getPrices('BATA', [2022, 2023])
+    closes = stock_data.getCloses(['BATB', 'BATA'], [2022, 2023])
+    batch.join()
+    after = stock_data.cache.counters()
+    assert after['upstream_calls'] - before['upstream_calls'] == 1 # the one batched download
+    assert after['coalesced_threads'] - before['coalesced_threads'] >= 1
+    assert provider.calls == [] # never a per-ticker request
+    pd.testing.assert_series_equal(closes['BATA'], prices['Close'], check_names=False, check_freq=False)
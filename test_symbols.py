@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for symbols - ticker normalization and search
+
+@author: Jack Vance
+"""
+import pytest
+
+from symbols import normalize, usLooking, parseSymbolDirectory, writeSymbols, SymbolIndex
+
+
+@pytest.mark.parametrize('raw, symbol', [('aapl', 'AAPL'),
+                                         (' msft ', 'MSFT'),
+                                         ('brk.b', 'BRK-B'), # share classes use yahoo's dash
+                                         ('BRK/B', 'BRK-B'),
+                                         ('bf-b', 'BF-B'),
+                                         ('ry.to', 'RY.TO'), # exchange suffixes stay
+                                         ('vod.l', 'VOD.L'),
+                                         ('7203.t', '7203.T'),
+                                         ('sap.f', 'SAP.F'),
+                                         ('^gspc', '^GSPC'),
+                                         ('eurusd=x', 'EURUSD=X')])
+def test_normalize(raw, symbol):
+    assert normalize(raw) == symbol
+    assert normalize(symbol) == symbol # idempotent
+
+@pytest.mark.parametrize('symbol, us', [('APPL', True), ('brk.b', True), ('BF-B', True),
+                                        ('RY.TO', False), ('vod.l', False), ('^GSPC', False),
+                                        ('EURUSD=X', False), ('BTC-USD', False)])
+def test_us_looking(symbol, us): # only these can be checked against the US listing
+    assert usLooking(symbol) == us
+
+def test_parse_directory():
+    text = ('Symbol|Security Name|Market Category|Test Issue\n'
+            'AAPL|Apple Inc. - Common Stock|Q|N\n'
+            'BRK.B|Berkshire Hathaway Inc. Class B|Q|N\n'
+            'ZZZT|Test Co - Common Stock|Q|Y\n'
+            'File Creation Time: 0101202400:00|||\n')
+    rows = parseSymbolDirectory(text, 'nasdaqlisted')
+    assert [row['symbol'] for row in rows] == ['AAPL', 'BRK-B'] # test issues and the footer dropped
+    assert rows[0]['name'] == 'Apple Inc.'
+
+def test_search(tmp_path):
+    path = str(tmp_path / 'symbols.csv')
+    writeSymbols([{'symbol': 'AAPL', 'name': 'Apple Inc.', 'exchange': 'NASDAQ'},
+                  {'symbol': 'BRK-B', 'name': 'Berkshire Hathaway Inc.', 'exchange': 'NYSE'},
+                  {'symbol': 'MSFT', 'name': 'Microsoft Corporation', 'exchange': 'NASDAQ'}], path)
+    index = SymbolIndex(path, seed=[('RY.TO', 'Royal Bank of Canada')])
+    assert not index.complete and 'RY.TO' in index # the seed is known before anything loads
+    assert index.load() and len(index) == 4
+    assert 'brk.b' in index and index.lookup('brk/b')['name'] == 'Berkshire Hathaway Inc.'
+    assert index.search('aap')[0]['symbol'] == 'AAPL'
+    assert index.search('micro')[0]['symbol'] == 'MSFT'
+    assert index.search('APPL')[0]['symbol'] == 'AAPL' # typo
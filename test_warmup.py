@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for warmup - the background warm-up scheduler
+
+@author: Jack Vance
+"""
+import time
+import threading
+
+import pytest
+
+import stock_data
+import warmup
+from providers import SyntheticProvider
+from warmup import WarmupScheduler
+
+
+@pytest.fixture
+def fetches(monkeypatch): # (ticker, dataset) the scheduler refreshed, from a small synthetic history
+    monkeypatch.setattr(stock_data, 'provider', SyntheticProvider(years=3))
+    fetched = []
+    refresh = stock_data.refreshDataset
+    def recordingRefresh(ticker, dataset, year_range):
+        fetched.append((ticker, dataset))
+        refresh(ticker, dataset, year_range)
+    monkeypatch.setattr(stock_data, 'refreshDataset', recordingRefresh)
+    monkeypatch.setattr(warmup, 'WARMUP_LEADER_RETRY', 0.05)
+    return fetched
+
+def waitFor(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_single_leader(tmp_path, fetches):
+    leader = WarmupScheduler(lock_dir=str(tmp_path))
+    follower = WarmupScheduler(['WRMA'], min_interval=0, lock_dir=str(tmp_path))
+    assert leader._lead() and not follower._lead()
+    follower.start()
+    try:
+        time.sleep(0.3)
+        assert fetches == [] # only the leader fetches, however many workers there are
+        leader._resign() # e.g. the leading worker exited
+        waitFor(lambda: len(fetches) == len(stock_data.datasets))
+        assert follower.leading
+        assert {dataset for _, dataset in fetches} == set(stock_data.datasets)
+        waitFor(lambda: all(entry['state'] == 'warm' for entry in follower.status()['WRMA'].values()))
+    finally:
+        follower.stop()
+        follower._thread.join(5)
+    assert not follower.leading and leader._lead() # given up on the way out
+
+def test_shared_tickers(tmp_path):
+    leader = WarmupScheduler(['AAPL'], lock_dir=str(tmp_path))
+    follower = WarmupScheduler(['AAPL'], lock_dir=str(tmp_path))
+    follower.add('WRMB') # a custom ticker picked on another worker
+    follower.add('AAPL')
+    assert leader.allTickers() == ['AAPL', 'WRMB']
+    assert WarmupScheduler(lock_dir=str(tmp_path))._next()[1:] == ('WRMB', 'balance_sheet') # cold, so due
+    assert 'WRMB' in leader.status()
+
+def test_yield_and_throttle(tmp_path):
+    scheduler = WarmupScheduler(min_interval=0.2, lock_dir=str(tmp_path))
+    scheduler.userRequestStarted()
+    threading.Timer(0.2, scheduler.userRequestFinished).start()
+    start = time.time()
+    scheduler._yield() # waits for the user request
+    assert time.time() - start >= 0.15 and scheduler.busy == 0
+    scheduler._last_fetch = time.time()
+    start = time.time()
+    scheduler._throttle()
+    assert time.time() - start >= 0.15
+
+def test_failed_fetch_backs_off(tmp_path, fetches, monkeypatch):
+    def failingRefresh(ticker, dataset, year_range):
+        fetches.append((ticker, dataset))
+        raise KeyError(ticker)
+    monkeypatch.setattr(stock_data, 'refreshDataset', failingRefresh)
+    scheduler = WarmupScheduler(['WRMC'], min_interval=0, lock_dir=str(tmp_path))
+    scheduler.start()
+    try:
+        waitFor(lambda: len(scheduler.errors) == len(stock_data.datasets))
+        time.sleep(0.2)
+        assert len(fetches) == len(stock_data.datasets) # not retried straight away
+        assert scheduler._next()[0] > time.time() + warmup.WARMUP_RETRY - 5
+        assert {entry['state'] for entry in scheduler.status()['WRMC'].values()} == {'error'}
+    finally:
+        scheduler.stop()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Background warm-up/refresh for the Stock Overview Dashboard
+
+@author: Jack Vance
+"""
+####
+# Warm-up Scheduler
+####
+
+# keeps every ticker in the dropdown warm so nobody's first click is a cold ~10s load.
+# one background thread walks the (ticker, dataset) pairs, refetching each a little before its
+# freshness window runs out. it throttles itself to stay under yahoo's rate limits and backs off
+# while users have requests in flight - interactive requests always go first.
+# with several workers only one of them warms: the first to take a (non-blocking) flock on
+# cache/locks/warmup.lock leads, the others check back every WARMUP_LEADER_RETRY and take over if it
+# exits - so the throttle holds across the whole server, not per process. a ticker added on any worker
+# goes into a shared list next to the lock for the leader to pick up (the latest WARMUP_SHARED_MAX)
+
+# imports
+import os
+import time
+import datetime
+import threading
+
+import stock_data
+from stock_cache import CACHE_DIR, fcntl
+
+WARMUP_MIN_INTERVAL = 2.0 # seconds between upstream fetches from the background thread
+WARMUP_REFRESH_MARGIN = 120 # refresh this long before a dataset goes stale
+WARMUP_RETRY = 5 * 60 # back off this long after a failed fetch
+WARMUP_MAX_YIELD = 30 # never wait on users longer than this, or a busy site would never warm up
+WARMUP_POLL = 1.0
+WARMUP_LEADER_RETRY = 10 # seconds between a follower's attempts to take over
+WARMUP_SHARED_MAX = 50 # tickers added on any worker the leader keeps warm, newest first
+
+
+class WarmupScheduler: # one daemon thread per process, only the leader's fetches
+    def __init__(self, tickers=(), year_range=None, build=None,
+                 min_interval=WARMUP_MIN_INTERVAL, refresh_margin=WARMUP_REFRESH_MARGIN, lock_dir=None):
+        if year_range is None: # whole history by default, the price store answers any slider range from it
+            year_range = [1993, datetime.date.today().year]
+        self.year_range = list(year_range)
+        self.build = build # optional hook(ticker) to pre-build figures once all of a ticker's data is warm
+        self.min_interval = min_interval
+        self.refresh_margin = refresh_margin
+        self.tickers = []
+        self.in_flight = None # (ticker, dataset) being fetched right now
+        self.errors = {} # (ticker, dataset) -> (retry at, message)
+        self.busy = 0 # user requests in flight
+        if lock_dir is None:
+            lock_dir = os.path.join(CACHE_DIR, 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock_path = os.path.join(lock_dir, 'warmup.lock')
+        self.shared_path = os.path.join(lock_dir, 'warmup.tickers')
+        self.leading = False
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_fetch = 0.0
+        for ticker in tickers: # every worker starts with these, no need to share them
+            self._add(ticker)
+
+    def _add(self, ticker): # True if it's new here
+        with self._lock:
+            if ticker and ticker not in self.tickers:
+                self.tickers.append(ticker)
+                return True
+        return False
+
+    def add(self, ticker): # here, and for whichever worker is leading
+        if self._add(ticker):
+            with open(self.shared_path, 'a') as f: # one short append, workers don't interleave
+                f.write(ticker + '\n')
+
+    def _shared(self): # tickers added on any worker, newest last
+        try:
+            with open(self.shared_path) as f:
+                added = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return list(dict.fromkeys(reversed(added)))[:WARMUP_SHARED_MAX][::-1]
+
+    def allTickers(self):
+        with self._lock:
+            tickers = list(self.tickers)
+        return tickers + [ticker for ticker in self._shared() if ticker not in tickers]
+
+    def _lead(self): # True once this process holds the warm-up lock
+        if self.leading:
+            return True
+        if fcntl is None: # windows, nothing to elect with - every worker warms (the dev server is one)
+            self.leading = True
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError: # another worker leads
+            lock_file.close()
+            return False
+        self._lock_file, self.leading = lock_file, True
+        return True
+
+    def _resign(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self.leading = False
+
+    # the dashboard brackets each user request with these
+    def userRequestStarted(self):
+        with self._lock:
+            self.busy += 1
+
+    def userRequestFinished(self):
+        with self._lock:
+            self.busy -= 1
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='stock-warmup', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _due(self, ticker, dataset): # epoch time this pair needs refetching
+        error = self.errors.get((ticker, dataset))
+        if error is not None:
+            return error[0]
+        expires = stock_data.datasetExpiry(ticker, dataset)
+        if expires is None:
+            return 0 # cold
+        return expires - self.refresh_margin
+
+    def _next(self): # most overdue (ticker, dataset), or None if nothing is due yet
+        tickers = self.allTickers()
+        due = [(self._due(ticker, dataset), ticker, dataset)
+               for ticker in tickers for dataset in stock_data.datasets]
+        if not due:
+            return None
+        return min(due)
+
+    def _warm(self, ticker): # every dataset answerable from the cache
+        return all(stock_data.datasetReady(ticker, dataset, self.year_range) for dataset in stock_data.datasets)
+
+    def _yield(self): # let user requests through first
+        waited = 0.0
+        while self.busy > 0 and waited < WARMUP_MAX_YIELD and not self._stop.is_set():
+            time.sleep(0.1)
+            waited += 0.1
+
+    def _throttle(self):
+        wait = self._last_fetch + self.min_interval - time.time()
+        if wait > 0:
+            self._stop.wait(wait)
+
+    def _run(self):
+        try:
+            self._warmLoop()
+        finally: # let another worker take over
+            self._resign()
+
+    def _warmLoop(self):
+        while not self._stop.is_set():
+            if not self._lead():
+                self._stop.wait(WARMUP_LEADER_RETRY)
+                continue
+            job = self._next()
+            if job is None or job[0] > time.time():
+                self._stop.wait(WARMUP_POLL)
+                continue
+            _, ticker, dataset = job
+            self._yield()
+            self._throttle()
+            if self._stop.is_set():
+                break
+            self.in_flight = (ticker, dataset)
+            try:
+                stock_data.refreshDataset(ticker, dataset, self.year_range)
+                self.errors.pop((ticker, dataset), None)
+            except Exception as e: # unknown ticker, yahoo hiccup... try again later
+                self.errors[(ticker, dataset)] = (time.time() + WARMUP_RETRY, repr(e))
+            finally:
+                self.in_flight = None
+                self._last_fetch = time.time()
+            # only once the whole ticker is warm - the build reads the cache, the fetching (throttled)
+            # is all done above
+            if self.build is not None and (ticker, dataset) not in self.errors and self._warm(ticker):
+                try:
+                    self.build(ticker)
+                except Exception:
+                    pass # figures just get built on the next user request instead
+
+    def status(self): # {ticker: {dataset: {'state': warm/stale/in flight/cold/error, 'expires': ...}}}
+        now = time.time()
+        tickers = self.allTickers()
+        report = {}
+        for ticker in tickers:
+            report[ticker] = {}
+            for dataset in stock_data.datasets:
+                expires = stock_data.datasetExpiry(ticker, dataset)
+                if self.in_flight == (ticker, dataset):
+                    state = 'in flight'
+                elif (ticker, dataset) in self.errors:
+                    state = 'error'
+                elif expires is None:
+                    state = 'cold'
+                elif expires <= now:
+                    state = 'stale'
+                else:
+                    state = 'warm'
+                entry = {'state': state,
+                         'expires': None if expires is None else datetime.datetime.fromtimestamp(expires).isoformat(timespec='seconds')}
+                if state == 'error':
+                    entry['error'] = self.errors[(ticker, dataset)][1]
+                report[ticker][dataset] = entry
+        return report